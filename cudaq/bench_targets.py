@@ -0,0 +1,115 @@
+import argparse
+import csv
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cudaq
+
+from circuits import FAMILIES
+
+# Times every circuit family across simulator targets and qubit counts, to
+# pick a backend per workload size. Each point runs in a fresh process, so
+# the reported peak RSS belongs to that point alone (rss_delta_mb subtracts
+# the peak after importing CUDA-Q), and a target that crashes the process
+# only loses its own point. The first launch (JIT compile + simulator
+# setup) is timed separately from the timed run.
+#
+# Usage: python bench_targets.py --qubits 4 8 12 16 --shots 1000 --csv targets.csv
+
+DEFAULT_TARGETS = ("qpp-cpu", "density-matrix-cpu", "tensornet", "tensornet-mps")
+
+# Points above these sizes are skipped rather than left to run out of memory
+MAX_QUBITS = {"qpp-cpu": 26, "density-matrix-cpu": 12}
+
+FIELDS = ("family", "target", "num_qubits", "shots", "status", "compile_s", "wall_s", "shots_per_s", "peak_rss_mb", "rss_delta_mb")
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_point(family: str, target: str, num_qubits: int, shots: int):
+    """Runs one (family, target, size) point in the current process and returns its CSV row."""
+    row = {"family": family, "target": target, "num_qubits": num_qubits, "shots": shots}
+    baseline_mb = _peak_rss_mb()
+
+    try:
+        cudaq.set_target(target)
+        kernel, args = FAMILIES[family](num_qubits)
+
+        start = time.perf_counter()
+        cudaq.sample(kernel, *args, shots_count=1)
+        row["compile_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cudaq.sample(kernel, *args, shots_count=shots)
+        row["wall_s"] = time.perf_counter() - start
+
+        row["shots_per_s"] = shots / row["wall_s"]
+        row["status"] = "ok"
+    except Exception as e:
+        row["status"] = f"error: {type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+
+    row["peak_rss_mb"] = _peak_rss_mb()
+    row["rss_delta_mb"] = row["peak_rss_mb"] - baseline_mb
+    return row
+
+
+def run_benchmark(families, targets, qubit_counts, shots: int, csv_path: str = None):
+    """
+    Runs every point, one fresh spawn process each, and writes the rows to csv_path as they finish.
+    Unavailable targets and sizes above MAX_QUBITS are recorded as skipped.
+    """
+    rows = []
+    writer = None
+    csv_file = open(csv_path, "w", newline="") if csv_path else None
+    if csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+        writer.writeheader()
+
+    context = multiprocessing.get_context("spawn")
+    try:
+        for target in targets:
+            for family in families:
+                for num_qubits in qubit_counts:
+                    if not cudaq.has_target(target):
+                        row = {"status": "skipped: target not available"}
+                    elif num_qubits > MAX_QUBITS.get(target, num_qubits):
+                        row = {"status": f"skipped: above {MAX_QUBITS[target]} qubits"}
+                    else:
+                        try:
+                            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                                row = pool.submit(run_point, family, target, num_qubits, shots).result()
+                        except BrokenProcessPool:
+                            row = {"status": "error: simulator process crashed"}
+
+                    row.update(family=family, target=target, num_qubits=num_qubits, shots=shots)
+                    rows.append(row)
+                    if writer:
+                        writer.writerow(row)
+                        csv_file.flush()
+
+                    print(f"{family:>16} {target:>18} {num_qubits:>4}  {row['status']:<8} "
+                          + (f"{row['wall_s']:.4f} s  {row['shots_per_s']:.0f} shots/s  {row['rss_delta_mb']:.0f} MB"
+                             if row["status"] == "ok" else ""))
+    finally:
+        if csv_file:
+            csv_file.close()
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--families", nargs="+", default=list(FAMILIES), choices=list(FAMILIES))
+    parser.add_argument("--targets", nargs="+", default=list(DEFAULT_TARGETS))
+    parser.add_argument("--qubits", nargs="+", type=int, default=[4, 8, 12, 16])
+    parser.add_argument("--shots", type=int, default=1000)
+    parser.add_argument("--csv", default="bench_targets.csv")
+    args = parser.parse_args()
+
+    run_benchmark(args.families, args.targets, args.qubits, args.shots, args.csv)
@@ -0,0 +1,99 @@
+import os
+import sys
+
+import numpy as np
+import cudaq
+
+# Benchmark circuit families, each parameterized by qubit count.
+#
+# Every generator returns (kernel, args): a builder kernel and the arguments
+# to launch it with, so the timing harness can treat all families alike.
+
+QLBM_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qlbm", "src")
+
+
+def tree_ghz(qubit_count: int, measure: bool = True):
+    """GHZ state in ceil(log2 n) CNOT layers: every prepared qubit copies itself onto a fresh one."""
+    kernel = cudaq.make_kernel()
+    q = kernel.qalloc(qubit_count)
+
+    kernel.h(q[0])
+    prepared = 1
+    while prepared < qubit_count:
+        for i in range(min(prepared, qubit_count - prepared)):
+            kernel.cx(q[i], q[prepared + i])
+        prepared *= 2
+
+    if measure:
+        kernel.mz(q)
+    return kernel, ()
+
+
+def qft(qubit_count: int, measure: bool = True):
+    """Textbook QFT on |1>^n (so the output is not trivially |0...0>), with the final swaps."""
+    kernel = cudaq.make_kernel()
+    q = kernel.qalloc(qubit_count)
+    kernel.x(q)
+
+    for j in range(qubit_count):
+        kernel.h(q[j])
+        for k in range(j + 1, qubit_count):
+            kernel.cr1(np.pi / 2**(k - j), q[k], q[j])
+    for j in range(qubit_count // 2):
+        kernel.swap(q[j], q[qubit_count - 1 - j])
+
+    if measure:
+        kernel.mz(q)
+    return kernel, ()
+
+
+def random_clifford(qubit_count: int, depth: int = None, seed: int = 0, measure: bool = True):
+    """`depth` layers (default n) of random h/s/sdg/x on every qubit, then cx on a random pairing."""
+    depth = qubit_count if depth is None else depth
+    rng = np.random.default_rng(seed)
+    kernel = cudaq.make_kernel()
+    q = kernel.qalloc(qubit_count)
+
+    single_qubit = (kernel.h, kernel.s, kernel.sdg, kernel.x)
+    for _ in range(depth):
+        for i, choice in enumerate(rng.integers(len(single_qubit), size=qubit_count)):
+            single_qubit[choice](q[i])
+        pairing = rng.permutation(qubit_count)
+        for a, b in zip(pairing[0::2], pairing[1::2]):
+            kernel.cx(q[int(a)], q[int(b)])
+
+    if measure:
+        kernel.mz(q)
+    return kernel, ()
+
+
+def qlbm_step(qubit_count: int, shift: str = "ripple"):
+    """One D1Q3 QLBM time step from poisson1D on qubit_count - 2 spatial qubits (plus the two coins)."""
+    if qubit_count < 3:
+        raise ValueError("qlbm_step needs qubit_count >= 3 (at least one spatial qubit plus the two coins).")
+    if QLBM_SRC not in sys.path:
+        sys.path.append(QLBM_SRC)
+    from poisson1D import build_qlbm_step_kernel, computecollisionangle, computeconstantangles
+
+    num_spatial_qubits = qubit_count - 2
+    kernel = build_qlbm_step_kernel(num_spatial_qubits, (), shift)
+    amplitudes = (np.ones(2**num_spatial_qubits) / np.sqrt(2**num_spatial_qubits)).astype(complex).tolist()
+
+    theta_collision = computecollisionangle(3, 0.2)
+    return kernel, (float(computeconstantangles(3)), [float(theta_collision)], amplitudes)
+
+
+FAMILIES = {
+    "tree_ghz": tree_ghz,
+    "qft": qft,
+    "random_clifford": random_clifford,
+    "qlbm_step": qlbm_step,
+}
+
+
+if __name__ == "__main__":
+    qubit_count = int(sys.argv[1]) if 1 < len(sys.argv) else 4
+
+    for name, family in FAMILIES.items():
+        kernel, args = family(qubit_count)
+        print(name, cudaq.sample(kernel, *args, shots_count=1000))
@@ -0,0 +1,151 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+# On-disk cache of the best circuit found for a compilation request.
+#
+# Entries are keyed by the target unitary up to global phase (normalized so
+# the first non-negligible entry is real and positive, then rounded), the
+# gate set of the prompt and the qubit count. Each entry is one .npz with
+# the winning token tensor, its params, its infidelity and the tokenizer
+# vocabulary it was sampled with, so a hit can be decoded without loading
+# the model; index.json keeps the LRU order. The index is read once per
+# process and entries stay in memory after their first load, so a repeated
+# request is a dict lookup. Recency from hits is written back at exit.
+
+
+def prompt_gate_set(prompt: str):
+    """Sorted gate names of a "Compile N qubits using: [...]" prompt, or the prompt itself."""
+    match = re.search(r"\[([^\]]*)\]", prompt)
+    if match is None:
+        return (prompt,)
+    return tuple(sorted(g.strip(" '\"") for g in match.group(1).split(",") if g.strip()))
+
+
+def canonical_unitary_key(U, gate_set: tuple, num_qubits: int, decimals: int = 8):
+    """Hex digest of a unitary up to global phase, together with the gate set and N."""
+    U = np.asarray(U, dtype=complex)
+    flat = U.reshape(-1)
+
+    pivot = flat[np.argmax(np.abs(flat) > 10.0**-decimals)]
+    flat = flat * (abs(pivot) / pivot)
+
+    # + 0.0 turns -0.0 into 0.0 so both round to the same bytes
+    rounded = np.round(np.stack([flat.real, flat.imag]), decimals) + 0.0
+    header = repr((U.shape, tuple(gate_set), num_qubits, decimals)).encode()
+
+    return hashlib.sha1(header + rounded.tobytes()).hexdigest()
+
+
+class CompileCache:
+    """
+    LRU cache of compilation results in `directory`.
+
+    Only results with infidelity <= threshold are stored or returned, and a
+    new result replaces an entry only if it is better. put() writes the
+    index right away; the LRU order changed by get() is written by flush(),
+    which also runs at interpreter exit.
+    """
+
+    def __init__(self, directory: str, maxsize: int = 1024, threshold: float = 1e-3, decimals: int = 8):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+
+        # key -> infidelity, oldest first; entries holds the loaded arrays
+        self._index = OrderedDict()
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._index.update(json.load(f))
+        self._entries = {}
+        self._dirty = False
+        atexit.register(self._flush_if_dirty)
+
+    def key(self, U, prompt: str, num_qubits: int):
+        return canonical_unitary_key(U, prompt_gate_set(prompt), num_qubits, self.decimals)
+
+    def _entry_path(self, key: str):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, U, prompt: str, num_qubits: int):
+        """(tensor, params, infidelity, vocabulary) of the cached circuit, or None; params and vocabulary may be None."""
+        key = self.key(U, prompt, num_qubits)
+        infidelity = self._index.get(key)
+
+        if infidelity is None or infidelity > self.threshold:
+            self.misses += 1
+            return None
+
+        if key not in self._entries:
+            try:
+                with np.load(self._entry_path(key)) as data:
+                    params = data["params"] if "params" in data.files else None
+                    vocabulary = json.loads(str(data["vocabulary"])) if "vocabulary" in data.files else None
+                    self._entries[key] = (data["tensor"], params, float(data["infidelity"]), vocabulary)
+            except FileNotFoundError:
+                del self._index[key]
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        if next(reversed(self._index)) != key:
+            self._index.move_to_end(key)
+            self._dirty = True
+        return self._entries[key]
+
+    def put(self, U, prompt: str, num_qubits: int, tensor, infidelity: float, params=None, vocabulary: dict = None):
+        """
+        Stores a result if it passes the threshold and beats the cached one. Returns True if stored.
+
+        vocabulary is the tokenizer vocabulary the tensor was sampled with.
+        """
+        infidelity = float(infidelity)
+        key = self.key(U, prompt, num_qubits)
+
+        if infidelity > self.threshold or self._index.get(key, np.inf) <= infidelity:
+            return False
+
+        arrays = {"tensor": np.asarray(tensor), "infidelity": np.float64(infidelity)}
+        if params is not None:
+            arrays["params"] = np.asarray(params)
+        if vocabulary is not None:
+            arrays["vocabulary"] = np.asarray(json.dumps(vocabulary))
+        np.savez(self._entry_path(key), **arrays)
+
+        self._index[key] = infidelity
+        self._index.move_to_end(key)
+        self._entries[key] = (arrays["tensor"], arrays.get("params"), infidelity, vocabulary)
+
+        while len(self._index) > self.maxsize:
+            evicted, _ = self._index.popitem(last=False)
+            self._entries.pop(evicted, None)
+            if os.path.exists(self._entry_path(evicted)):
+                os.remove(self._entry_path(evicted))
+
+        self.flush()
+        return True
+
+    def flush(self):
+        """Writes the LRU order, so recency from get() survives the process."""
+        with open(self._index_path + ".tmp", "w") as f:
+            json.dump(list(self._index.items()), f)
+        os.replace(self._index_path + ".tmp", self._index_path)
+        self._dirty = False
+
+    def _flush_if_dirty(self):
+        if self._dirty:
+            self.flush()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._index)}
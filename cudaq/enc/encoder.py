@@ -1,107 +1,321 @@
 # This is the CUDA-Q documentation tutorial on 
 # Unitary compilation for Diffusion Models (Discrete)
 
-import cudaq
-import torch
-import numpy as np
-import genQC
+from __future__ import annotations
+
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-os.environ['HF_HUB_DISABLE_PROGRESS_BARS'] = '1'
+import numpy as np
 
-import genQC.utils.misc_utils as util
-from genQC.pipeline.diffusion_pipeline import DiffusionPipeline
-from genQC.pipeline.multimodal_diffusion_pipeline \
-            import MultimodalDiffusionPipeline_ParametrizedCompilation
+from evaluation import batched_unitaries, proxy_infidelities, screen_candidates
+from compile_cache import CompileCache
 
-from genQC.platform.tokenizer.circuits_tokenizer import CircuitTokenizer
-from genQC.platform.simulation import Simulator, CircuitBackendType
-from genQC.scheduler.scheduler_dpm import DPMScheduler
+os.environ.setdefault('HF_HUB_DISABLE_PROGRESS_BARS', '1')
 
-from genQC.inference.sampling \
-            import decode_tensors_to_backend, generate_compilation_tensors
-from genQC.inference.evaluation_helper import get_unitaries
-from genQC.inference.eval_metrics import UnitaryInfidelityNorm
-from genQC.benchmark.bench_compilation import SpecialUnitaries
+##### LAZY SETUP #####
 
-def verify_unitary(U: torch.Tensor):
-    """Check if unitary."""
-    assert torch.allclose(U.adjoint() @ U, torch.eye(2**N, dtype=U.dtype))
-    assert torch.allclose(U @ U.adjoint(), torch.eye(2**N, dtype=U.dtype))
+# torch, genQC and CUDA-Q take seconds to import and the pipeline has to be
+# downloaded or loaded from disk, so everything heavy is imported and built
+# on first use. test_import_time.py keeps `import encoder` within budget.
 
-def sample_kernels_and_evaluate(U: torch.Tensor,
-                                prompt: str,
-                                num_of_qubits: int,
-                                samples: int,
-                                discrete_model: bool,
-                                return_tensors: bool = False):
-    """
-    Sample the DM and return generated kernels with coresponding infidelities.
-    """
+# Hugging Face repo id, or a local directory with the pipeline's config and
+# weights. With GENQC_OFFLINE=1 only the local Hugging Face cache is used.
+# Both can also be set on the module before the first get_discrete_pipeline().
+DISCRETE_MODEL = os.environ.get("GENQC_DISCRETE_MODEL", "Floki00/qc_unitary_3qubit")
+OFFLINE        = os.environ.get("GENQC_OFFLINE", "0") == "1"
 
-    # 1) Check if unitary
-    verify_unitary(U)
+# These parameters are specific to our pre-trained model.
+discrete_system_size   = 3
+discrete_max_gates     = 12
+discrete_timesteps     = 40
+
+@lru_cache(maxsize=None)
+def get_device():
+    """Use CUDA if we have a GPU."""
+    import genQC.utils.misc_utils as util
+    return util.infer_torch_device()
+
+def run_large_model():
+    """Flag to only run large model if GPU available."""
+    import torch
+    return get_device() == torch.device("cuda")
+
+@lru_cache(maxsize=None)
+def get_simulator():
+    from genQC.platform.simulation import Simulator, CircuitBackendType
+    return Simulator(CircuitBackendType.CUDAQ,
+                     target='qpp-cpu')  # Target for cudaq, note that cpu is faster for low qubit kernels
+
+@lru_cache(maxsize=None)
+def get_discrete_pipeline():
+    if OFFLINE:
+        # Read by huggingface_hub when it is first imported
+        os.environ["HF_HUB_OFFLINE"] = "1"
+
+    from genQC.pipeline.diffusion_pipeline import DiffusionPipeline
+
+    if os.path.isdir(DISCRETE_MODEL):
+        pipeline = DiffusionPipeline.from_config_file(os.path.join(DISCRETE_MODEL, ""), device=get_device())
+    else:
+        pipeline = DiffusionPipeline.from_pretrained(
+                    repo_id=DISCRETE_MODEL, # Download model from Hugging Face
+                    device=get_device())
 
-    # 2) Generate tensor representations using the DM based on the prompt and U.
-    U = U.to(torch.complex64)
+    pipeline.scheduler.set_timesteps(discrete_timesteps)
+    return pipeline
+
+def tokenizer_from_vocabulary(vocabulary: dict):
+    """CircuitTokenizer for a saved vocabulary, e.g. from a compile cache hit, without the pipeline."""
+    from genQC.platform.tokenizer.circuits_tokenizer import CircuitTokenizer
+    return CircuitTokenizer(vocabulary)
+
+@lru_cache(maxsize=None)
+def get_discrete_tokenizer():
+    gate_pool = get_discrete_pipeline().gate_pool
+    discrete_vocabulary = {g:i+1 for i, g in enumerate(gate_pool)}
+    return tokenizer_from_vocabulary(discrete_vocabulary)
+
+##### COMPILATION #####
+
+def unitarity_deviation(U: torch.Tensor, probes: int = None, seed: int = 0):
+    """
+    ||U^dag U - I||_F for a (d, d) or (B, d, d) tensor, one value per item.
+
+    A square U with U^dag U = I also has U U^dag = I, so one Gram product
+    suffices, and the identity is subtracted on its diagonal in place. With
+    probes=k the norm is estimated from k random unit vectors x instead,
+    using E||(U^dag U - I) x||^2 = ||U^dag U - I||_F^2 / d, at O(k d^2).
+    """
+    import torch
+
+    d = U.shape[-1]
+
+    if probes is None:
+        gram = U.adjoint() @ U
+        gram.diagonal(dim1=-2, dim2=-1).sub_(1)
+        return torch.linalg.matrix_norm(gram)
+
+    generator = torch.Generator(device=U.device).manual_seed(seed)
+    x = torch.randn(d, probes, dtype=U.dtype, device=U.device, generator=generator)
+    x = x / torch.linalg.vector_norm(x, dim=0)
+
+    residual = U.adjoint() @ (U @ x) - x
+    return torch.sqrt(d / probes * torch.linalg.vector_norm(residual, dim=(-2, -1))**2)
+
+def verify_unitary(U: torch.Tensor, tol: float = 1e-5, probes: int = None):
+    """Check if unitary: ||U^dag U - I||_F <= tol * sqrt(d) for every item of U."""
+    deviation = unitarity_deviation(U, probes)
+    limit = tol * U.shape[-1]**0.5
+    assert bool((deviation <= limit).all()), f"Not unitary: max ||U^dag U - I||_F = {deviation.max().item():.2e}"
+
+def generate_tensors(U: torch.Tensor,
+                     prompt: str,
+                     num_of_qubits: int,
+                     samples: int,
+                     discrete_model: bool,
+                     no_bar: bool = False):
+    """
+    Sample the DM for U; returns (out_tensor, params, tokenizer), or None if
+    the continuous model is skipped.
+    """
+    from genQC.inference.sampling import generate_compilation_tensors
 
     if discrete_model:
         # Sample discrete model
-        out_tensor = generate_compilation_tensors(discrete_pipeline,
+        out_tensor = generate_compilation_tensors(get_discrete_pipeline(),
                                   prompt=prompt,
                                   U=U,
                                   samples=samples,      # How many circuits we sample per unitary
                                   system_size=discrete_system_size,
-                                  num_of_qubits=N,
+                                  num_of_qubits=num_of_qubits,
                                   max_gates=discrete_max_gates,
                                   g=10.0,               # classifier-free-guidance (CFG) scale
-                                  no_bar=False,         # show progress bar
+                                  no_bar=no_bar,        # show progress bar
                                   auto_batch_size=256,  # for less GPU memory usage limit batch size
                                   tensor_prod_pad=False,
                                   enable_params=False,
                                  )
-        tokenizer = discrete_tokenizer
-        params    = None
-
-    else:
-        if not RUN_LARGE_MODEL:
-            print(f">> Skipped sampling large model. Flag: {RUN_LARGE_MODEL=} <<")
-            if return_tensors:
-                return [], [], []
-            return [], []
-
-        # Sample continuous model
-        out_tensor, params = generate_compilation_tensors(cont_pipeline,
-                                  prompt=prompt,
-                                  U=U,
-                                  samples=samples,     # How many circuits we sample per unitary
-                                  system_size=cont_system_size,
-                                  num_of_qubits=N,
-                                  max_gates=cont_max_gates,
-                                  no_bar=False,        # show progress bar
-                                  auto_batch_size=256, # for less GPU memory usage limit batch size
-                                 )
-        tokenizer = cont_tokenizer
+        return out_tensor, None, get_discrete_tokenizer()
+
+    if not run_large_model():
+        print(f">> Skipped sampling large model. Flag: {run_large_model()=} <<")
+        return None
+
+    # Sample continuous model
+    out_tensor, params = generate_compilation_tensors(cont_pipeline,
+                              prompt=prompt,
+                              U=U,
+                              samples=samples,     # How many circuits we sample per unitary
+                              system_size=cont_system_size,
+                              num_of_qubits=num_of_qubits,
+                              max_gates=cont_max_gates,
+                              no_bar=no_bar,       # show progress bar
+                              auto_batch_size=256, # for less GPU memory usage limit batch size
+                             )
+    return out_tensor, params, cont_tokenizer
+
+def evaluate_tensors(U: torch.Tensor,
+                     num_of_qubits: int,
+                     out_tensor: torch.Tensor,
+                     params,
+                     tokenizer,
+                     keep: int = None):
+    """
+    Decode sampled tensors and score them against U; returns
+    (kernels, infidelities, tensors). With keep set, candidates screened
+    out by the random-state estimate get an infidelity of inf.
+    """
+    import torch
+    from genQC.inference.sampling import decode_tensors_to_backend
+    from genQC.inference.evaluation_helper import get_unitaries
+    from genQC.inference.eval_metrics import UnitaryInfidelityNorm
 
-    # 3) Convert tensors to kernels
-    generated_kernels, _, generated_tensors = decode_tensors_to_backend(simulator=simulator,
+    # Convert tensors to kernels
+    generated_kernels, _, generated_tensors = decode_tensors_to_backend(simulator=get_simulator(),
                                                      tokenizer=tokenizer,
                                                      tensors=out_tensor,
                                                      params=params,
                                                      return_tensors=True)
 
-    # 4) Evaluate the kernels and return the unitaries
-    generated_us = get_unitaries(simulator, generated_kernels, num_qubits=N)
+    # Evaluate the kernels and return the unitaries
+    if params is None:
+        generated_tensors_np = generated_tensors.cpu().numpy()
+        survivors = np.arange(len(generated_kernels))
+
+        if keep is not None and keep < len(survivors):
+            # Screen on O(k 2^N) random-state overlaps before building any unitary
+            proxy = proxy_infidelities(generated_tensors_np, tokenizer.vocabulary,
+                                       U.cpu().numpy(), num_qubits=num_of_qubits)
+            survivors = screen_candidates(proxy, keep)
 
-    # 5) Calculate the infidelities to the target U
+        # One batched pass over the token tensors, straight into a (B, 2^N, 2^N) array
+        generated_us = torch.from_numpy(batched_unitaries(generated_tensors_np[survivors],
+                                                          tokenizer.vocabulary, num_qubits=num_of_qubits))
+    else:
+        survivors = None
+        generated_us = torch.from_numpy(np.stack(get_unitaries(get_simulator(), generated_kernels, num_qubits=num_of_qubits)))
+
+    # Calculate the infidelities to the target U
     infidelities = UnitaryInfidelityNorm.distance(
-                    approx_U=torch.from_numpy(np.stack(generated_us)).to(torch.complex128),
+                    approx_U=generated_us.to(torch.complex128),
                     target_U=U.unsqueeze(0).to(torch.complex128))
 
+    # Screened-out candidates were never unitarized; inf keeps them out of argmin/top-k
+    if survivors is not None and len(survivors) < len(generated_kernels):
+        screened = torch.full((len(generated_kernels),), float("inf"), dtype=infidelities.dtype)
+        screened[torch.from_numpy(survivors)] = infidelities
+        infidelities = screened
+
+    return generated_kernels, infidelities, generated_tensors
+
+def sample_kernels_and_evaluate(U: torch.Tensor,
+                                prompt: str,
+                                num_of_qubits: int,
+                                samples: int,
+                                discrete_model: bool,
+                                return_tensors: bool = False,
+                                keep: int = None):
+    """
+    Sample the DM and return generated kernels with coresponding infidelities.
+
+    With keep set (discrete model only), candidates are first ranked on a
+    random-state estimate and only the `keep` best are fully unitarized;
+    the others report an infidelity of inf.
+    """
+    import torch
+
+    # 1) Check if unitary
+    verify_unitary(U)
+
+    # 2) Generate tensor representations using the DM based on the prompt and U.
+    U = U.to(torch.complex64)
+    generated = generate_tensors(U, prompt, num_of_qubits, samples, discrete_model)
+
+    if generated is None:
+        if return_tensors:
+            return [], [], []
+        return [], []
+
+    # 3) Decode and evaluate
+    generated_kernels, infidelities, generated_tensors = evaluate_tensors(U, num_of_qubits, *generated, keep=keep)
+
     if return_tensors:
         return generated_kernels, infidelities, generated_tensors
     return generated_kernels, infidelities
 
+def stream_kernels_and_evaluate(U: torch.Tensor,
+                                prompt: str,
+                                num_of_qubits: int,
+                                samples: int,
+                                discrete_model: bool,
+                                batch_size: int = 64,
+                                target_infidelity: float = None,
+                                enough: int = 1,
+                                return_tensors: bool = False,
+                                keep_per_batch: int = None):
+    """
+    sample_kernels_and_evaluate as a producer/consumer pipeline.
+
+    Samples are drawn batch_size at a time; while batch i+1 is generated,
+    batch i is decoded and evaluated on one worker thread (kernels cannot
+    be pickled, so no process pool, and the shared CUDA-Q simulator is not
+    safe to use from several threads at once). With target_infidelity set,
+    sampling stops once `enough` candidates are at or below it. If no
+    batch decodes to a kernel, infidelities and tensors are empty lists.
+
+    keep_per_batch screens each batch on its own: its best keep_per_batch
+    candidates are unitarized and the rest report inf, so up to
+    keep_per_batch * ceil(samples / batch_size) survive in total. (keep in
+    sample_kernels_and_evaluate counts across all samples, which would
+    need every batch's estimate before the first unitary.)
+    """
+    import torch
+
+    verify_unitary(U)
+    U = U.to(torch.complex64)
+
+    kernels, infidelities, tensors = [], [], []
+
+    def collect(result):
+        kernels.extend(result[0])
+        infidelities.append(result[1])
+        tensors.append(result[2])
+
+    def done():
+        if target_infidelity is None:
+            return False
+        return sum(int((i <= target_infidelity).sum()) for i in infidelities) >= enough
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = deque()
+        generated_samples = 0
+
+        while generated_samples < samples and not done():
+            batch_samples = min(batch_size, samples - generated_samples)
+            generated = generate_tensors(U, prompt, num_of_qubits, batch_samples, discrete_model, no_bar=True)
+            if generated is None:
+                break
+            generated_samples += batch_samples
+            pending.append(pool.submit(evaluate_tensors, U, num_of_qubits, *generated, keep=keep_per_batch))
+
+            # Collect whatever finished; block only if evaluation falls behind
+            while pending and (pending[0].done() or len(pending) > 1):
+                collect(pending.popleft().result())
+
+        for future in pending:
+            collect(future.result())
+
+    if infidelities:
+        infidelities = torch.cat(infidelities)
+        tensors = torch.cat(tensors)
+
+    if return_tensors:
+        return kernels, infidelities, tensors
+    return kernels, infidelities
+
 def plot_topk_kernels(generated_kernels: list,
                       infidelities: torch.Tensor,
                       num_of_qubits:int,
@@ -109,11 +323,12 @@ def plot_topk_kernels(generated_kernels: list,
     """
     Plot the topk best generated kernels.
     """
+    import cudaq
 
-    # Get topk indices
-    best_indices = np.argsort(infidelities)[:topk]
+    # Get topk indices, skipping candidates that were screened out (inf)
+    best_indices = [i for i in np.argsort(infidelities)[:topk] if np.isfinite(infidelities[i])]
 
-    input_state = [0] * (2**N)
+    input_state = [0] * (2**num_of_qubits)
     input_state[0] = 1
 
     # Print the circuits
@@ -126,53 +341,66 @@ def plot_topk_kernels(generated_kernels: list,
 
 ##### MAIN #####
 
-device = util.infer_torch_device() # Use CUDA if we have a GPU
-print(device)
-
-# Flag to only run large model if GPU available
-RUN_LARGE_MODEL = ( device == torch.device("cuda") )
-print(f"GPU Present: {RUN_LARGE_MODEL}")
-print()
-
-# We set a seed to pytorch, numpy and python.
-# Note: This will also set deterministic cuda algorithms, possibly at the cost of reduced performance!
-util.set_seed(0)
-
-simulator = Simulator(CircuitBackendType.CUDAQ,
-                      target='qpp-cpu')  # Target for cudaq, note that cpu is faster for low qubit kernels
-
-discrete_pipeline = DiffusionPipeline.from_pretrained(
-            repo_id="Floki00/qc_unitary_3qubit", # Download model from Hugging Face
-            device=device)
-
-gate_pool = discrete_pipeline.gate_pool
-print(gate_pool)
-print()
-
-discrete_vocabulary = {g:i+1 for i, g in enumerate(gate_pool)}
-discrete_tokenizer  = CircuitTokenizer(discrete_vocabulary)
-discrete_tokenizer.vocabulary
-
-# These parameters are specific to our pre-trained model.
-discrete_system_size   = 3
-discrete_max_gates     = 12
-
-timesteps = 40
-discrete_pipeline.scheduler.set_timesteps(timesteps)
-
-#####
-
-N = 4 # num_of_qubits
-U = SpecialUnitaries.QFT(N)
-
-# Notice how the x gate is missing from the prompt since this is a restriction we set
-prompt = f"Compile {N} qubits using: ['h', 'cx', 'ccx', 'swap', 'rx', 'ry', 'rz', 'cp']"
-
-generated_kernels, infidelities = sample_kernels_and_evaluate(
-                                          U=U,
-                                          prompt=prompt,
-                                          num_of_qubits=N,
-                                          samples=64,
-                                          discrete_model=True)
-
-plot_topk_kernels(generated_kernels, infidelities, N, topk=5)
+if __name__ == "__main__":
+    import torch
+    import genQC.utils.misc_utils as util
+    from genQC.inference.sampling import decode_tensors_to_backend
+    from genQC.benchmark.bench_compilation import SpecialUnitaries
+
+    device = get_device()
+    print(device)
+
+    print(f"GPU Present: {run_large_model()}")
+    print()
+
+    # We set a seed to pytorch, numpy and python.
+    # Note: This will also set deterministic cuda algorithms, possibly at the cost of reduced performance!
+    util.set_seed(0)
+
+    #####
+
+    N = 4 # num_of_qubits
+    U = SpecialUnitaries.QFT(N)
+
+    # Notice how the x gate is missing from the prompt since this is a restriction we set
+    prompt = f"Compile {N} qubits using: ['h', 'cx', 'ccx', 'swap', 'rx', 'ry', 'rz', 'cp']"
+
+    # Best circuits found so far, keyed by the target unitary, gate set and N
+    compile_cache = CompileCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".compile_cache"))
+    cached = compile_cache.get(U, prompt, N)
+
+    if cached is None:
+        print(get_discrete_pipeline().gate_pool)
+        print()
+
+        # Evaluate each batch of 16 while the next is sampled; stop once top-k are good enough
+        generated_kernels, infidelities, generated_tensors = stream_kernels_and_evaluate(
+                                                  U=U,
+                                                  prompt=prompt,
+                                                  num_of_qubits=N,
+                                                  samples=64,
+                                                  discrete_model=True,
+                                                  batch_size=16,
+                                                  target_infidelity=compile_cache.threshold,
+                                                  enough=5,
+                                                  return_tensors=True)
+
+        if len(infidelities) > 0:
+            best_index = int(torch.argmin(infidelities))
+            compile_cache.put(U, prompt, N, generated_tensors[best_index].cpu().numpy(), infidelities[best_index].item(),
+                              vocabulary=get_discrete_tokenizer().vocabulary)
+    else:
+        tensor, params, infidelity, vocabulary = cached
+        print(f"Loaded cached circuit (infidelity {infidelity:0.1e}).")
+        # Entries written before the vocabulary was stored still need the pipeline
+        tokenizer = tokenizer_from_vocabulary(vocabulary) if vocabulary is not None else get_discrete_tokenizer()
+        generated_kernels = decode_tensors_to_backend(simulator=get_simulator(),
+                                                      tokenizer=tokenizer,
+                                                      tensors=torch.from_numpy(tensor).unsqueeze(0),
+                                                      params=params)[0]
+        infidelities = torch.tensor([infidelity])
+
+    if len(infidelities) > 0:
+        plot_topk_kernels(generated_kernels, infidelities, N, topk=5)
+    else:
+        print("No valid circuits were generated.")
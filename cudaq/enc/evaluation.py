@@ -0,0 +1,178 @@
+import numpy as np
+
+# Batched unitaries for genQC token tensors.
+#
+# get_unitaries builds one kernel per sample and simulates it column by
+# column. Here the whole batch is one (B, 2^N, 2^N) array: every time step
+# groups the samples that place the same gate on the same qubits and
+# applies that gate to all of them with a single matmul. Qubit q is bit q
+# of the basis index (qubit 0 is the LSB), as in CUDA-Q.
+
+_SQRT2 = np.sqrt(2)
+
+FIXED_GATES = {
+    "h":    np.array([[1, 1], [1, -1]]) / _SQRT2,
+    "x":    np.array([[0, 1], [1, 0]]),
+    "y":    np.array([[0, -1j], [1j, 0]]),
+    "z":    np.diag([1, -1]),
+    "s":    np.diag([1, 1j]),
+    "sdg":  np.diag([1, -1j]),
+    "t":    np.diag([1, np.exp(1j * np.pi / 4)]),
+    "tdg":  np.diag([1, np.exp(-1j * np.pi / 4)]),
+    "swap": np.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]]),
+}
+
+
+def rotation_gates(name: str, theta: np.ndarray):
+    """(m, 2, 2) matrices of a one-parameter gate for m angles."""
+    theta = np.asarray(theta, dtype=float).reshape(-1)
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    gates = np.zeros((theta.shape[0], 2, 2), dtype=complex)
+
+    if name == "rx":
+        gates[:, 0, 0] = gates[:, 1, 1] = c
+        gates[:, 0, 1] = gates[:, 1, 0] = -1j * s
+    elif name == "ry":
+        gates[:, 0, 0] = gates[:, 1, 1] = c
+        gates[:, 0, 1], gates[:, 1, 0] = -s, s
+    elif name == "rz":
+        gates[:, 0, 0], gates[:, 1, 1] = np.exp(-0.5j * theta), np.exp(0.5j * theta)
+    elif name in ("p", "r1"):
+        gates[:, 0, 0], gates[:, 1, 1] = 1, np.exp(1j * theta)
+    else:
+        raise KeyError(f"Unknown gate '{name}'.")
+
+    return gates
+
+
+def controlled(gates: np.ndarray, num_controls: int):
+    """Adds num_controls leading control qubits to (m, 2^k, 2^k) gates."""
+    if num_controls == 0:
+        return gates
+    m, size = gates.shape[0], gates.shape[-1]
+    full = np.broadcast_to(np.eye(size << num_controls, dtype=complex), (m, size << num_controls, size << num_controls)).copy()
+    full[:, -size:, -size:] = gates
+    return full
+
+
+def apply_gates(states: np.ndarray, gates: np.ndarray, qubits: tuple, num_qubits: int):
+    """
+    Left-multiplies (m, 2^N, c) states by (m, 2^k, 2^k) gates on `qubits`.
+
+    The first listed qubit is the most significant bit of the gate's index.
+    """
+    shape = states.shape
+    m, k = shape[0], len(qubits)
+
+    # Row index as N binary axes; axis 1 + (N-1-q) is qubit q
+    tensor = states.reshape((m,) + (2,) * num_qubits + shape[2:])
+    axes = [1 + num_qubits - 1 - q for q in qubits]
+    tensor = np.moveaxis(tensor, axes, range(1, k + 1))
+    moved_shape = tensor.shape
+
+    tensor = np.matmul(gates, tensor.reshape(m, 2**k, -1))
+    tensor = np.moveaxis(tensor.reshape(moved_shape), range(1, k + 1), axes)
+
+    return tensor.reshape(shape)
+
+
+def decode_column(column: np.ndarray, gate_names: dict):
+    """(gate, controls, targets) of one tensor column; gate is None for padding."""
+    targets = tuple(np.flatnonzero(column > 0).tolist())
+    controls = tuple(np.flatnonzero(column < 0).tolist())
+    if not targets:
+        return None, controls, targets
+
+    name = gate_names[int(abs(column[targets[0]]))]
+    # genQC names controlled gates "c" * k + base gate
+    if controls and name.startswith("c" * len(controls)):
+        name = name[len(controls):]
+    return name, controls, targets
+
+
+def batched_apply(tensors, vocabulary: dict, num_qubits: int, states: np.ndarray, params=None):
+    """
+    Applies every circuit of a batch of genQC token tensors to `states`.
+
+    tensors is (B, >= num_qubits, T): +token on targets, -token on controls.
+    states is (2^N, c), shared by all circuits, or (B, 2^N, c).
+    params, if given, is (B, P, T) with gate t's angle at params[b, 0, t].
+    Returns a (B, 2^N, c) complex128 array.
+    """
+    tensors = np.asarray(tensors)[:, :num_qubits]
+    batch, _, num_timesteps = tensors.shape
+    gate_names = {token: gate for gate, token in vocabulary.items()}
+    if params is not None:
+        params = np.asarray(params, dtype=float)
+
+    states = np.asarray(states, dtype=complex)
+    states = np.broadcast_to(states, (batch,) + states.shape[-2:]).copy()
+
+    for t in range(num_timesteps):
+        columns = tensors[:, :, t]
+        groups = {}
+        for b in np.flatnonzero(np.any(columns != 0, axis=1)):
+            groups.setdefault(columns[b].tobytes(), []).append(b)
+
+        for members in groups.values():
+            name, controls, targets = decode_column(columns[members[0]], gate_names)
+            if name is None:
+                continue
+
+            if name in FIXED_GATES:
+                gates = FIXED_GATES[name].astype(complex)[None]
+            elif params is not None:
+                gates = rotation_gates(name, params[members, 0, t])
+            else:
+                raise ValueError(f"Gate '{name}' needs params.")
+            gates = controlled(gates, len(controls))
+
+            if len(members) == batch:
+                states = apply_gates(states, gates, controls + targets, num_qubits)
+            else:
+                states[members] = apply_gates(states[members], gates, controls + targets, num_qubits)
+
+    return states
+
+
+def batched_unitaries(tensors, vocabulary: dict, num_qubits: int, params=None):
+    """Unitaries of a batch of genQC token tensors, as one (B, 2^N, 2^N) complex128 array."""
+    return batched_apply(tensors, vocabulary, num_qubits, np.eye(2**num_qubits), params)
+
+
+# --- Two-stage screening ---
+#
+# For Haar-random states, E[<psi|U^dag V|psi>] = Tr(U^dag V) / 2^N, so a few
+# states give an O(k 2^N) estimate of the unitary infidelity
+# 1 - |Tr(U^dag V) / 2^N|^2. Candidates far from U are ruled out on that
+# estimate, and only the survivors are unitarized.
+
+def random_states(num_qubits: int, num_states: int, seed: int = 0):
+    """(2^N, k) matrix of Haar-random states."""
+    rng = np.random.default_rng(seed)
+    states = rng.normal(size=(2**num_qubits, num_states)) + 1j * rng.normal(size=(2**num_qubits, num_states))
+    return states / np.linalg.norm(states, axis=0)
+
+
+def proxy_infidelities(tensors, vocabulary: dict, target_U: np.ndarray, num_qubits: int,
+                       num_states: int = 8, params=None, seed: int = 0):
+    """Random-state estimate of each candidate's unitary infidelity to target_U."""
+    states = random_states(num_qubits, num_states, seed)
+    target_states = np.asarray(target_U, dtype=complex) @ states
+
+    outputs = batched_apply(tensors, vocabulary, num_qubits, states, params)
+    overlaps = np.einsum("ik,bik->b", target_states.conj(), outputs) / num_states
+
+    return 1 - np.abs(overlaps)**2
+
+
+def screen_candidates(proxy: np.ndarray, keep: int, threshold: float = None):
+    """
+    Indices of the candidates to unitarize: the `keep` best proxies, plus
+    any other candidate with a proxy at or below `threshold`.
+    """
+    order = np.argsort(proxy, kind="stable")
+    survivors = order[:keep]
+    if threshold is not None:
+        survivors = np.union1d(survivors, np.flatnonzero(proxy <= threshold))
+    return np.sort(survivors)
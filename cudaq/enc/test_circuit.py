@@ -0,0 +1,88 @@
+import cudaq
+import numpy as np
+import pytest
+
+from circuit import (GHZ, circuit_depth, dataset_circuit, encode_dataset, load_dataset, parse_cudaq_kernel,
+                     schedule_triples, triples_to_tokens)
+
+
+def test_parse_quake_string_with_loop():
+    kernel = cudaq.make_kernel()
+    q = kernel.qalloc(3)
+    kernel.h(q)  # Lowers to cc.loop
+    kernel.cx(q[0], q[1])
+
+    quake_str = str(kernel)
+    assert "cc.loop" in quake_str
+
+    triples = parse_cudaq_kernel(quake_str)
+    np.testing.assert_array_equal(triples, parse_cudaq_kernel(kernel))
+    assert list(triples["gate"]) == ["h", "h", "h", "cx", "cx"]
+    assert list(triples["qubit"]) == [0, 1, 2, 0, 1]
+
+
+@cudaq.kernel
+def decorated_loop_kernel():
+    q = cudaq.qvector(3)
+    for i in range(3):
+        h(q[i])
+    x.ctrl(q[0], q[2])
+
+
+def test_parse_decorated_kernel_with_loop():
+    triples = parse_cudaq_kernel(decorated_loop_kernel)
+
+    np.testing.assert_array_equal(triples, parse_cudaq_kernel(str(decorated_loop_kernel)))
+    assert list(triples["gate"]) == ["h", "h", "h", "cx", "cx"]
+    assert list(triples["qubit"]) == [0, 1, 2, 0, 2]
+
+
+def test_parse_long_gate_name_and_veq_control():
+    quake_str = """
+    %0 = quake.alloca !quake.veq<3>
+    %1 = quake.subveq %0, 0, 1 : (!quake.veq<3>) -> !quake.veq<2>
+    %2 = quake.extract_ref %0[2] : (!quake.veq<3>) -> !quake.ref
+    quake.phased_rx (%a, %b) %2 : (f64, f64, !quake.ref) -> ()
+    quake.x [%1] %2 : (!quake.veq<2>, !quake.ref) -> ()
+    """
+    triples = parse_cudaq_kernel(quake_str)
+
+    assert list(triples["gate"]) == ["phased_rx", "ccx", "ccx", "ccx"]
+    assert list(triples["qubit"]) == [2, 0, 1, 2]
+    assert list(triples["control"]) == [False, True, True, False]
+
+
+def test_parse_unresolved_value():
+    with pytest.raises(ValueError):
+        parse_cudaq_kernel("quake.h %7 : (!quake.ref) -> ()")
+
+
+def test_tokens_need_one_gate_per_column():
+    kernel = cudaq.make_kernel()
+    q = kernel.qalloc(2)
+    kernel.h(q[0])
+    kernel.rx(0.5, q[1])
+    triples = parse_cudaq_kernel(kernel)
+
+    assert circuit_depth(triples) == 1
+    with pytest.raises(ValueError):
+        triples_to_tokens(schedule_triples(triples), {"h": 1, "rx": 2})
+
+    torch = pytest.importorskip("torch")
+    tokens = triples_to_tokens(triples, {"h": 1, "rx": 2})
+    assert torch.equal(tokens, torch.tensor([[1, 0], [0, 2]], dtype=torch.int32))
+
+
+def test_dataset_round_trip(tmp_path):
+    path = str(tmp_path / "shard")
+    kernels = [GHZ(3), str(GHZ(2))]
+    assert encode_dataset(kernels, path, capacity=100, max_workers=0) == 2
+
+    triples, offsets, vocabulary = load_dataset(path)
+    assert len(triples) == offsets[-1] == 8
+    assert vocabulary == {"h": 1, "cx": 2}
+
+    circuit = dataset_circuit(triples, offsets, 1)
+    assert list(circuit["gate"]) == [1, 2, 2]
+    assert list(circuit["qubit"]) == [0, 0, 1]
+    assert list(circuit["control"]) == [False, True, False]
@@ -0,0 +1,44 @@
+import os
+import re
+import subprocess
+import sys
+
+# Import-time budget for encoder.py, measured with `python -X importtime`.
+#
+# `import encoder` must stay within the budget and must not pull in one of
+# the heavy packages that encoder.py defers to first use.
+
+HEAVY_PACKAGES = ("torch", "genQC", "cudaq", "huggingface_hub")
+BUDGET_MS = 500.0
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+
+def measure_import_time(module: str = "encoder", cwd: str = None):
+    """
+    Returns (module_ms, {package: cumulative_ms}) for a fresh `import module`.
+
+    module_ms is the cumulative time of the module's own entry, so imports
+    every interpreter pays at startup (site, encodings) are not counted.
+    """
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match is not None:
+            cumulative[match.group(3)] = int(match.group(2)) / 1e3
+
+    return cumulative[module], cumulative
+
+
+def test_encoder_import_time():
+    module_ms, cumulative = measure_import_time("encoder")
+    heavy = sorted({name.split(".")[0] for name in cumulative if name.split(".")[0] in HEAVY_PACKAGES})
+
+    assert not heavy, f"import encoder eagerly imports {', '.join(heavy)}"
+    assert module_ms <= BUDGET_MS, f"import encoder took {module_ms:.1f} ms (budget {BUDGET_MS:.0f} ms)"
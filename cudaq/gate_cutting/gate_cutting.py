@@ -0,0 +1,651 @@
+import hashlib
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cudaq
+from cudaq import spin
+
+from unitary_cache import KakCache, register_unitary
+
+# Gate cutting engine, extracted from gate_cutting.ipynb.
+#
+# The circuit is the notebook's staircase: gate i is a 4x4 unitary on
+# qubits (i, i+1), qubit 0 optionally starts with a Hadamard, and the
+# observable is a Pauli string (all X by default). Cutting gates c_1 < ...
+# < c_k splits the qubits into fragments [c_{j-1} + 1, c_j], and only the
+# cut gates act across fragments.
+#
+# A cut gate G = (A1 x A0) Can (B1 x B0), Can = sum_P c_P Pa x Pb, acts on a
+# product state as G rho G^dag = sum_{P,Q} c_P conj(c_Q) (.. Pa rho Qa ..) x
+# (.. Pb rho Qb ..), so the expectation is a sum over (P, Q) of products of
+# per-fragment values f(Pa, Qa) = Tr[O V Pa sigma Qa V^dag]. The P = Q terms
+# are the ones the notebook measures; the P != Q cross terms make the sum
+# exact. Each f is measured with one ancilla per cut: the ancilla in |+>
+# selects P (|0>) or Q (|1>) on the cut qubit, and
+# f = <O X_anc> - i <O Y_anc>.
+
+PAULI_NAMES = "IXYZ"
+
+# Decompositions persist across runs here, one .npz per distinct cut gate
+KAK_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".kak_cache")
+kak_cache = KakCache(KAK_CACHE_DIR)
+
+# Single qubit Pauli matrices, in PAULI_NAMES order
+SINGLE_QUBIT_PAULIS = np.array([[[1, 0], [0, 1]],
+                                [[0, 1], [1, 0]],
+                                [[0, -1j], [1j, 0]],
+                                [[1, 0], [0, -1]]], dtype=complex)
+
+# All 16 two-qubit Paulis P1 x P2, built once; index 4 * p1 + p2 is TWO_QUBIT_PAULI_NAMES[index]
+TWO_QUBIT_PAULI_NAMES = [p1 + p2 for p1 in PAULI_NAMES for p2 in PAULI_NAMES]
+PAULI_BASIS = np.einsum('aij,bkl->abikjl', SINGLE_QUBIT_PAULIS, SINGLE_QUBIT_PAULIS).reshape(16, 4, 4)
+
+
+# --- 1. QPD ---
+
+def get_two_qubit_paulis():
+    """All 16 two-qubit Pauli combinations as a dictionary (views of PAULI_BASIS)."""
+    return dict(zip(TWO_QUBIT_PAULI_NAMES, PAULI_BASIS))
+
+
+def canonical_gates(x, y, z):
+    """
+    Canonical gates exp(i(x XX + y YY + z ZZ)) for arrays of parameters, shape (..., 4, 4).
+
+    XX, YY and ZZ commute and square to I, so the exponential is the product
+    of (cos t I + i sin t PP) over the three terms.
+    """
+    x, y, z = np.broadcast_arrays(*(np.asarray(t, dtype=float) for t in (x, y, z)))
+    gate = np.broadcast_to(PAULI_BASIS[0], x.shape + (4, 4)).astype(complex)
+    for t, index in ((x, 5), (y, 10), (z, 15)):
+        factor = (np.cos(t)[..., None, None] * PAULI_BASIS[0]
+                  + 1j * np.sin(t)[..., None, None] * PAULI_BASIS[index])
+        gate = gate @ factor
+    return gate
+
+
+def batched_QPD(x, y, z):
+    """Pauli coefficients c_P = 1/4 Tr(A P) of the canonical gates, shape (..., 16)."""
+    return np.einsum('...ij,pji->...p', canonical_gates(x, y, z), PAULI_BASIS) * 0.25
+
+
+def QPD(kak_result):
+    """
+    Quasi-Probability Distribution - decompose canonical gate into Pauli coefficients.
+
+    Returns a dictionary mapping Pauli strings to c_P = 1/4 Tr(A P), where
+    A = exp(i(x XX + y YY + z ZZ)) is the canonical gate.
+    """
+    coefficients = batched_QPD(kak_result.x, kak_result.y, kak_result.z)
+    return dict(zip(TWO_QUBIT_PAULI_NAMES, coefficients))
+
+
+def kak_decompose(matrix: np.ndarray):
+    """KAK factors of a 4x4 unitary, copied into plain arrays so fragments pickle into worker processes."""
+    kak_result = cudaq.unitary_synthesis.kak_decompose(matrix)
+    return types.SimpleNamespace(x=kak_result.x, y=kak_result.y, z=kak_result.z,
+                                 **{f: np.asarray(getattr(kak_result, f)) for f in ("a0", "a1", "b0", "b1")})
+
+
+def cached_kak_decompose(matrix: np.ndarray):
+    """kak_decompose, run once per distinct matrix (see unitary_cache.KakCache)."""
+    return kak_cache.get(matrix, kak_decompose)
+
+
+def cut_terms(coefficients: np.ndarray, threshold: float = 1e-10):
+    """
+    Terms (Pa, Qa, Pb, Qb, weight) of one cut from its 16 QPD coefficients,
+    weight = c_{PaPb} conj(c_{QaQb}).
+
+    Pa/Qa act on the gate's first qubit and Pb/Qb on its second; weights
+    with |weight| <= threshold are dropped, as qpd_data_filtered did.
+    """
+    weights = np.outer(coefficients, np.conj(coefficients))
+
+    terms = []
+    for p, q in zip(*np.nonzero(np.abs(weights) > threshold)):
+        (pa, pb), (qa, qb) = TWO_QUBIT_PAULI_NAMES[p], TWO_QUBIT_PAULI_NAMES[q]
+        terms.append((pa, qa, pb, qb, weights[p, q]))
+    return terms
+
+
+# --- 2. Fragments ---
+
+def pauli_rotation_angles(pauli: str):
+    """(rx, ry, rz) angles that apply the Pauli up to a global phase."""
+    return [np.pi if pauli == axis else 0.0 for axis in "XYZ"]
+
+
+def insertion_angles(p: str, q: str):
+    """
+    Seven kernel angles for one cut insertion: P on the cut qubit, then
+    Q P (controlled on the ancilla) with its phase, so the ancilla's |0>
+    branch carries P and its |1> branch carries Q.
+    """
+    product = SINGLE_QUBIT_PAULIS[PAULI_NAMES.index(q)] @ SINGLE_QUBIT_PAULIS[PAULI_NAMES.index(p)]
+
+    # Q P = omega R for a single Pauli R
+    overlaps = np.einsum('rij,ji->r', SINGLE_QUBIT_PAULIS, product) / 2
+    r = PAULI_NAMES[int(np.argmax(np.abs(overlaps)))]
+    omega = overlaps[PAULI_NAMES.index(r)]
+
+    # crx/cry/crz(pi) apply -i R, which the ancilla phase absorbs
+    phase = np.angle(omega) + (np.pi / 2 if r != 'I' else 0.0)
+    return pauli_rotation_angles(p) + pauli_rotation_angles(r) + [phase]
+
+
+class Fragment:
+    """
+    Qubits [start, stop] of the staircase with their gates and adjacent cuts.
+
+    left_cut / right_cut are (cut index, kak_result) or None; the left cut
+    acts on the first qubit as the gate's second qubit (A0, B0), the right
+    cut on the last qubit as the gate's first qubit (A1, B1).
+    """
+
+    def __init__(self, index: int, start: int, stop: int, gates: list, left_cut, right_cut,
+                 observable: str, initial_hadamard: bool):
+        self.index = index
+        self.start = start
+        self.stop = stop
+        self.gates = gates
+        self.left_cut = left_cut
+        self.right_cut = right_cut
+        self.observable = observable
+        self.initial_hadamard = initial_hadamard
+
+    @property
+    def num_qubits(self):
+        return self.stop - self.start + 1
+
+    @property
+    def cuts(self):
+        return [cut for cut in (self.left_cut, self.right_cut) if cut is not None]
+
+    @property
+    def key(self):
+        """Digest of everything the fragment kernel and observables depend on."""
+        digest = hashlib.sha1(repr((self.start, self.stop, self.observable, self.initial_hadamard,
+                                    self.left_cut is not None, self.right_cut is not None)).encode())
+        for _, matrix in self.gates:
+            digest.update(np.asarray(matrix, dtype=complex).tobytes())
+        for _, kak_result in self.cuts:
+            for factor in ("a0", "a1", "b0", "b1"):
+                digest.update(np.asarray(getattr(kak_result, factor), dtype=complex).tobytes())
+        return digest.hexdigest()
+
+
+def make_fragments(circuit: list, cut_indices: list, observable: str = None, initial_hadamard: bool = True):
+    """Splits the staircase at cut_indices; returns (fragments, kak results of the cuts)."""
+    num_qubits = len(circuit) + 1
+    observable = observable or "X" * num_qubits
+    cut_indices = sorted(cut_indices)
+    if len(observable) != num_qubits:
+        raise ValueError(f"observable must have {num_qubits} Paulis.")
+    if not all(0 <= c < len(circuit) for c in cut_indices) or len(set(cut_indices)) != len(cut_indices):
+        raise ValueError("cut_indices must be distinct gate indices.")
+
+    kak_results = [cached_kak_decompose(np.asarray(circuit[c])) for c in cut_indices]
+
+    bounds = [-1] + cut_indices + [len(circuit)]
+    fragments = []
+    for j in range(len(bounds) - 1):
+        start, stop = bounds[j] + 1, bounds[j + 1]
+        gates = [(i, np.asarray(circuit[i])) for i in range(start, stop)]
+        left_cut = (cut_indices[j - 1], kak_results[j - 1]) if j > 0 else None
+        right_cut = (cut_indices[j], kak_results[j]) if j < len(cut_indices) else None
+        fragments.append(Fragment(j, start, stop, gates, left_cut, right_cut,
+                                  observable[start:stop + 1], initial_hadamard and j == 0))
+
+    return fragments, kak_results
+
+
+def _apply_insertion(kernel, qubit, ancilla, angles, offset: int):
+    kernel.rx(angles[offset], qubit)
+    kernel.ry(angles[offset + 1], qubit)
+    kernel.rz(angles[offset + 2], qubit)
+    kernel.crx(angles[offset + 3], ancilla, qubit)
+    kernel.cry(angles[offset + 4], ancilla, qubit)
+    kernel.crz(angles[offset + 5], ancilla, qubit)
+    kernel.r1(angles[offset + 6], ancilla)
+
+
+def build_fragment_kernel(fragment: Fragment):
+    """
+    Kernel taking 7 angles per adjacent cut (insertion_angles, left cut
+    first). Data qubits come first, then one ancilla per cut.
+    """
+    # Operations are named by matrix hash, so repeated gates and KAK
+    # factors register once and never clash across circuits
+    gate_names = {i: register_unitary(matrix) for i, matrix in fragment.gates}
+    left, right = [{factor: register_unitary(getattr(cut[1], factor)) for factor in ("a0", "a1", "b0", "b1")}
+                   if cut is not None else None for cut in (fragment.left_cut, fragment.right_cut)]
+
+    kernel, angles = cudaq.make_kernel(list[float])
+    q = kernel.qalloc(fragment.num_qubits + len(fragment.cuts))
+    ancillas = [q[fragment.num_qubits + k] for k in range(len(fragment.cuts))]
+
+    if fragment.initial_hadamard:
+        kernel.h(q[0])  # Force the expectation to be non-zero, as in the notebook
+    for ancilla in ancillas:
+        kernel.h(ancilla)
+
+    offset = 0
+    if fragment.left_cut is not None:
+        getattr(kernel, left["b0"])(q[0])
+        _apply_insertion(kernel, q[0], ancillas[0], angles, offset)
+        getattr(kernel, left["a0"])(q[0])
+        offset += 7
+
+    for i, _ in fragment.gates:
+        getattr(kernel, gate_names[i])(q[i - fragment.start], q[i - fragment.start + 1])
+
+    if fragment.right_cut is not None:
+        last = q[fragment.num_qubits - 1]
+        getattr(kernel, right["b1"])(last)
+        _apply_insertion(kernel, last, ancillas[-1], angles, offset)
+        getattr(kernel, right["a1"])(last)
+
+    return kernel
+
+
+def fragment_observables(fragment: Fragment):
+    """(spin operators, complex weights): f = sum_k weight_k <operator_k>."""
+    data = 1.0
+    for i, pauli in enumerate(fragment.observable):
+        if pauli != 'I':
+            data = data * getattr(spin, pauli.lower())(i)
+
+    operators, weights = [], []
+    for ancilla_paulis in itertools.product("XY", repeat=len(fragment.cuts)):
+        operator, weight = data, 1.0
+        for k, pauli in enumerate(ancilla_paulis):
+            operator = operator * getattr(spin, pauli.lower())(fragment.num_qubits + k)
+            weight *= 1.0 if pauli == 'X' else -1j
+        operators.append(operator)
+        weights.append(weight)
+
+    # A fragment without cuts and an identity observable measures 1
+    if isinstance(operators[0], float):
+        operators[0] = spin.i(0)
+    return operators, weights
+
+
+def fragment_args(key: tuple):
+    """Kernel angles for a fragment key ((P, Q) per adjacent cut, left first)."""
+    angles = []
+    for p, q in key:
+        angles += insertion_angles(p, q)
+    return angles
+
+
+# --- 3. Scheduling ---
+
+_fragment_cache = {}
+
+
+def _fragment_setup(fragment: Fragment):
+    """Kernel and observables of a fragment, built once per process."""
+    key = fragment.key
+    if key not in _fragment_cache:
+        _fragment_cache[key] = (build_fragment_kernel(fragment), *fragment_observables(fragment))
+    return _fragment_cache[key]
+
+
+def measure_fragment_term(fragment: Fragment, key: tuple, qpu_id: int = 0, shots=None):
+    """
+    Expectations of the fragment_observables operators for one key, on one QPU.
+
+    shots gives a shot count per operator (0 skips it and reports 0); None
+    computes exact expectations.
+    """
+    kernel, operators, _ = _fragment_setup(fragment)
+    args = fragment_args(key)
+    shots = [-1] * len(operators) if shots is None else [int(n) for n in shots]
+
+    futures = [cudaq.observe_async(kernel, operator, args, qpu_id=qpu_id, shots_count=n) if n != 0 else None
+               for operator, n in zip(operators, shots)]
+    return np.array([future.get().expectation() if future is not None else 0.0 for future in futures])
+
+
+def run_fragment_term(fragment: Fragment, key: tuple, qpu_id: int = 0):
+    """Complex fragment value f for one key, on one QPU."""
+    weights = _fragment_setup(fragment)[2]
+    return np.dot(weights, measure_fragment_term(fragment, key, qpu_id))
+
+
+def _run_process_job(fragment: Fragment, key: tuple, target: str, shots):
+    if cudaq.get_target().name != target:
+        cudaq.set_target(target)
+    return measure_fragment_term(fragment, key, shots=shots)
+
+
+def run_subexperiments(jobs: list, executor: str = "qpu", max_workers: int = None, shots: dict = None):
+    """
+    Runs (fragment, key) jobs; returns {(fragment index, key): operator
+    expectations} (see measure_fragment_term, and fragment_values to turn
+    them into f). shots optionally maps a job to its per-operator shots.
+
+    executor="qpu": one thread per QPU of the current target, each taking
+    the next job from a shared queue when it finishes one, so fast QPUs
+    do more of the work. executor="process": a spawn process pool, which
+    hands each idle worker the next pending job; every worker builds its
+    fragment kernels once.
+    """
+    if executor not in ("qpu", "process"):
+        raise ValueError("executor must be either 'qpu' or 'process'.")
+
+    shots = shots or {}
+    results = {}
+
+    if executor == "process":
+        target = cudaq.get_target().name
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+            futures = {(fragment.index, key): pool.submit(_run_process_job, fragment, key, target,
+                                                          shots.get((fragment.index, key)))
+                       for fragment, key in jobs}
+            for job, future in futures.items():
+                results[job] = future.result()
+        return results
+
+    pending = queue.SimpleQueue()
+    for job in jobs:
+        pending.put(job)
+    # Kernels are built here so the worker threads only launch them
+    for fragment, _ in jobs:
+        _fragment_setup(fragment)
+
+    errors = []
+
+    def worker(qpu_id: int):
+        while not errors:
+            try:
+                fragment, key = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                job = (fragment.index, key)
+                results[job] = measure_fragment_term(fragment, key, qpu_id, shots.get(job))
+            except Exception as e:
+                errors.append(e)
+
+    num_qpus = max_workers or cudaq.get_target().num_qpus()
+    threads = [threading.Thread(target=worker, args=(qpu_id,)) for qpu_id in range(num_qpus)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+def fragment_values(jobs: list, measurements: dict):
+    """Complex f per job from its operator expectations."""
+    return {(fragment.index, key): np.dot(fragment_observables(fragment)[1], measurements[(fragment.index, key)])
+            for fragment, key in jobs}
+
+
+# --- 4. Cutting and reconstruction ---
+
+def cut_weights(terms: list):
+    """
+    Sparse form of one cut: the distinct (Pa, Qa) and (Pb, Qb) pairs that
+    survive pruning, and the weight matrix W[(Pa, Qa), (Pb, Qb)] over them.
+    """
+    a_pairs = list(dict.fromkeys((t[0], t[1]) for t in terms))
+    b_pairs = list(dict.fromkeys((t[2], t[3]) for t in terms))
+
+    W = np.zeros((len(a_pairs), len(b_pairs)), dtype=complex)
+    for pa, qa, pb, qb, weight in terms:
+        W[a_pairs.index((pa, qa)), b_pairs.index((pb, qb))] = weight
+    return a_pairs, b_pairs, W
+
+
+def fragment_pairs(fragment: Fragment, cuts: list):
+    """(P, Q) pairs per adjacent cut of the fragment, left cut first."""
+    j = fragment.index
+    pairs = []
+    if fragment.left_cut is not None:
+        pairs.append(cuts[j - 1][1])
+    if fragment.right_cut is not None:
+        pairs.append(cuts[j][0])
+    return pairs
+
+
+def plan_subexperiments(fragments: list, kak_results: list, threshold: float = 1e-10):
+    """
+    Pruned cuts (see cut_weights) and the (fragment, key) jobs they need.
+
+    Terms with |weight| <= threshold are dropped, so a fragment only runs
+    the pairs that some surviving term of each adjacent cut uses: with k
+    cuts that is at most 16^2 keys per fragment instead of 16^k products.
+    """
+    # One batched QPD for every cut
+    coefficients = batched_QPD(*(np.array([getattr(k, axis) for k in kak_results]) for axis in "xyz"))
+    cuts = [cut_weights(cut_terms(c, threshold)) for c in coefficients]
+
+    jobs = []
+    for fragment in fragments:
+        jobs += [(fragment, key) for key in itertools.product(*fragment_pairs(fragment, cuts))]
+    return cuts, jobs
+
+
+def fragment_tensor(fragment: Fragment, cuts: list, results: dict):
+    """Fragment values indexed by the position of each adjacent cut's pair in fragment_pairs."""
+    pairs = fragment_pairs(fragment, cuts)
+
+    F = np.zeros([len(p) for p in pairs], dtype=complex)
+    for index in itertools.product(*[range(len(p)) for p in pairs]):
+        key = tuple(p[i] for p, i in zip(pairs, index))
+        F[index] = results[(fragment.index, key)]
+    return F
+
+
+def _chain_operands(fragments: list, cuts: list, tensors: list):
+    """
+    einsum operands of the chain F_0 W_1 F_1 ... W_k F_k.
+
+    Axis 2c - 2 is cut c's first-qubit pair and axis 2c - 1 its second-qubit
+    pair, so W_c carries [2c - 2, 2c - 1], and fragment j carries the
+    second-qubit axis of its left cut and the first-qubit axis of its right.
+    """
+    operands = []
+    for fragment, F in zip(fragments, tensors):
+        j = fragment.index
+        axes = []
+        if fragment.left_cut is not None:
+            axes.append(2 * j - 1)
+        if fragment.right_cut is not None:
+            axes.append(2 * j)
+        operands += [F, axes]
+
+    for c, (_, _, W) in enumerate(cuts, start=1):
+        operands += [W, [2 * c - 2, 2 * c - 1]]
+    return operands
+
+
+def reconstruct_expectation(fragments: list, cuts: list, results: dict):
+    """Contracts the chain F_0 W_1 F_1 ... W_k F_k with one einsum."""
+    tensors = [fragment_tensor(fragment, cuts, results) for fragment in fragments]
+    return np.einsum(*_chain_operands(fragments, cuts, tensors), [], optimize=True)
+
+
+def reconstruction_gradients(fragments: list, cuts: list, tensors: list):
+    """dE/dF_j for every fragment tensor: the chain contracted without F_j."""
+    operands = _chain_operands(fragments, cuts, tensors)
+
+    gradients = []
+    for j in range(len(fragments)):
+        others = operands[:2 * j] + operands[2 * j + 2:]
+        gradients.append(np.einsum(*others, operands[2 * j + 1], optimize=True) if others else np.ones(()))
+    return gradients
+
+
+def cut_circuit_expectation(circuit: list, cut_indices: list, observable: str = None, initial_hadamard: bool = True,
+                            executor: str = "qpu", max_workers: int = None, threshold: float = 1e-10):
+    """
+    Expectation of `observable` after the staircase circuit, with the gates
+    at cut_indices cut. Returns (expectation, number of subexperiments).
+    """
+    fragments, kak_results = make_fragments(circuit, cut_indices, observable, initial_hadamard)
+    cuts, jobs = plan_subexperiments(fragments, kak_results, threshold)
+    results = fragment_values(jobs, run_subexperiments(jobs, executor, max_workers))
+
+    expectation = reconstruct_expectation(fragments, cuts, results)
+    return float(np.real(expectation)), len(jobs)
+
+
+# --- 5. Shot allocation ---
+
+def allocate_shots(importance: np.ndarray, shots: int, min_shots: int = 0):
+    """
+    Splits `shots` in proportion to importance (largest remainder first),
+    after giving every entry with importance > 0 min_shots (lowered if the
+    budget cannot cover them).
+    """
+    importance = np.asarray(importance, dtype=float)
+    active = importance > 0
+    min_shots = min(min_shots, shots // max(active.sum(), 1))
+
+    allocation = np.where(active, min_shots, 0)
+    remaining = shots - allocation.sum()
+    if remaining > 0 and importance.sum() > 0:
+        share = remaining * importance / importance.sum()
+        allocation += np.floor(share).astype(int)
+        leftover = int(shots - allocation.sum())
+        allocation[np.argsort(np.floor(share) - share)[:leftover]] += 1
+    return allocation
+
+
+def _job_index(fragment: Fragment, cuts: list, key: tuple):
+    return tuple(pairs.index(pq) for pairs, pq in zip(fragment_pairs(fragment, cuts), key))
+
+
+def adaptive_cut_expectation(circuit: list, cut_indices: list, total_shots: int, target_error: float = None,
+                             round_shots: int = None, min_shots: int = 10, observable: str = None,
+                             initial_hadamard: bool = True, executor: str = "qpu", max_workers: int = None,
+                             threshold: float = 1e-10):
+    """
+    Shot-based cut_circuit_expectation that spends at most total_shots, in rounds of round_shots
+    (default total_shots / 10), and stops once the standard error is <= target_error.
+
+    Every measured operator <O_k> enters the reconstruction with a
+    sensitivity s_k = |dE/d<O_k>|. Round one splits its shots in proportion
+    to s_k with all fragment values set to 1, i.e. to the |QPD weight| the
+    operator carries. Later rounds top every operator up towards
+    n_k ~ s_k sigma_k (sigma_k^2 = 1 - <O_k>^2 per shot), the split that
+    minimizes Var(E) = sum_k s_k^2 sigma_k^2 / n_k, using current estimates.
+
+    Returns (expectation, standard error, history); history has one
+    {"round", "shots", "expectation", "variance"} dict per round.
+    """
+    fragments, kak_results = make_fragments(circuit, cut_indices, observable, initial_hadamard)
+    cuts, jobs = plan_subexperiments(fragments, kak_results, threshold)
+    round_shots = round_shots or max(total_shots // 10, 1)
+
+    # One entry per (job, operator)
+    fragment_weights = {fragment.index: np.array(fragment_observables(fragment)[1]) for fragment in fragments}
+    weights = np.concatenate([fragment_weights[fragment.index] for fragment, _ in jobs])
+    owner = np.repeat(np.arange(len(jobs)), [len(fragment_weights[fragment.index]) for fragment, _ in jobs])
+    job_indices = [_job_index(fragment, cuts, key) for fragment, key in jobs]
+
+    counts = np.zeros(len(weights), dtype=int)
+    means = np.zeros(len(weights))
+
+    def job_gradients(cuts, tensors):
+        gradients = reconstruction_gradients(fragments, cuts, tensors)
+        return np.array([gradients[fragment.index][index] for (fragment, _), index in zip(jobs, job_indices)])[owner]
+
+    # dE/d<O_k> for unit fragment values and |W|
+    ones = [np.ones([len(p) for p in fragment_pairs(fragment, cuts)]) for fragment in fragments]
+    sensitivity = np.abs(weights * job_gradients([(a, b, np.abs(W)) for a, b, W in cuts], ones))
+    sigma = np.ones(len(weights))
+
+    history = []
+    used = 0
+    expectation, variance = 0.0, np.inf
+    while used < total_shots:
+        budget = min(round_shots, total_shots - used)
+        if not history:
+            allocation = allocate_shots(sensitivity, budget, min_shots)
+        else:
+            target = (used + budget) * sensitivity * sigma / np.sum(sensitivity * sigma)
+            allocation = allocate_shots(np.maximum(target - counts, 0), budget)
+        if allocation.sum() == 0:
+            break
+
+        round_jobs = [job for i, job in enumerate(jobs) if allocation[owner == i].any()]
+        shots = {(fragment.index, key): allocation[owner == i] for i, (fragment, key) in enumerate(jobs)}
+        measurements = run_subexperiments(round_jobs, executor, max_workers, shots)
+
+        new = np.zeros(len(weights))
+        for i, (fragment, key) in enumerate(jobs):
+            if (fragment.index, key) in measurements:
+                new[owner == i] = measurements[(fragment.index, key)]
+        total = counts + allocation
+        means = np.where(total > 0, (counts * means + allocation * new) / np.maximum(total, 1), 0.0)
+        counts = total
+        used += int(allocation.sum())
+
+        # Estimates and first-order variance of the reconstruction
+        values = np.zeros(len(jobs), dtype=complex)
+        np.add.at(values, owner, weights * means)
+        results = {(fragment.index, key): values[i] for i, (fragment, key) in enumerate(jobs)}
+        tensors = [fragment_tensor(fragment, cuts, results) for fragment in fragments]
+        expectation = float(np.real(np.einsum(*_chain_operands(fragments, cuts, tensors), [], optimize=True)))
+
+        sensitivity = np.abs(np.real(weights * job_gradients(cuts, tensors)))
+        sigma = np.sqrt(np.maximum(1 - means**2, 1 / (counts + 1)))
+        measured = counts > 0
+        variance = (np.sum(sensitivity[measured]**2 * sigma[measured]**2 / counts[measured])
+                    if np.all(measured | (sensitivity == 0)) else np.inf)
+
+        history.append({"round": len(history) + 1, "shots": used, "expectation": expectation, "variance": variance})
+
+        if target_error is not None and np.sqrt(variance) <= target_error:
+            break
+
+    return expectation, float(np.sqrt(variance)), history
+
+
+def exact_expectation(circuit: list, observable: str = None, initial_hadamard: bool = True):
+    """Uncut statevector reference (qubit 0 is the most significant, as in the custom operations)."""
+    num_qubits = len(circuit) + 1
+    observable = observable or "X" * num_qubits
+    state = np.zeros(2**num_qubits, dtype=complex)
+    state[0] = 1
+    if initial_hadamard:
+        state = np.kron(np.array([[1, 1], [1, -1]]) / np.sqrt(2), np.eye(2**(num_qubits - 1))) @ state
+    for i, gate in enumerate(circuit):
+        state = np.kron(np.kron(np.eye(2**i), gate), np.eye(2**(num_qubits - i - 2))) @ state
+
+    operator = np.ones((1, 1))
+    for pauli in observable:
+        operator = np.kron(operator, SINGLE_QUBIT_PAULIS[PAULI_NAMES.index(pauli)])
+    return float(np.real(np.vdot(state, operator @ state)))
+
+
+if __name__ == "__main__":
+    cnot_gate = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
+    circuit = [cnot_gate] * 5  # 5 CNOT gates
+
+    print(f"Number of QPUs available: {cudaq.get_target().num_qpus()}")
+    print(f"Exact expectation: {exact_expectation(circuit):.6f}")
+    for cut_indices in ([2], [1, 3]):
+        expectation, num_subexperiments = cut_circuit_expectation(circuit, cut_indices)
+        print(f"Cuts {cut_indices}: {expectation:.6f} from {num_subexperiments} subexperiments")
+
+    expectation, standard_error, history = adaptive_cut_expectation(circuit, [2], total_shots=100000, target_error=0.01)
+    for entry in history:
+        print(f"Round {entry['round']}: {entry['shots']} shots, "
+              f"expectation {entry['expectation']:.6f} +/- {np.sqrt(entry['variance']):.6f}")
+    print(f"Shot-based, cut [2]: {expectation:.6f} +/- {standard_error:.6f}")
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import tempfile
+import types
+
+import numpy as np
+import cudaq
+
+# Memoized custom operations and KAK decompositions, keyed by the matrix.
+#
+# A circuit built from repeated two-qubit blocks (the notebook's five
+# CNOTs) registers each distinct matrix once per process, under a name
+# derived from its hash, and decomposes it once: KAK results stay in
+# memory and are stored as one .npz per matrix, so later runs skip
+# kak_decompose entirely.
+
+KAK_FACTORS = ("a0", "a1", "b0", "b1")
+
+_registered = set()
+
+
+def matrix_key(matrix, decimals: int = 10):
+    """Hex digest of a matrix's shape and entries, rounded to `decimals`."""
+    matrix = np.asarray(matrix, dtype=complex)
+    # + 0.0 turns -0.0 into 0.0 so both round to the same bytes
+    rounded = np.round(np.stack([matrix.real, matrix.imag]), decimals) + 0.0
+    return hashlib.sha1(repr(matrix.shape).encode() + rounded.tobytes()).hexdigest()
+
+
+def register_unitary(matrix):
+    """Registers the matrix as a custom operation once per process; returns its name."""
+    name = f"u_{matrix_key(matrix)[:16]}"
+    if name not in _registered:
+        cudaq.register_operation(name, np.asarray(matrix, dtype=complex))
+        _registered.add(name)
+    return name
+
+
+class KakCache:
+    """
+    KAK decompositions by matrix_key, in memory and (if directory is given)
+    as <key>.npz files holding x, y, z and the four local factors. The
+    directory is created on the first store.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def _entry_path(self, key: str):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _load(self, key: str):
+        if not self.directory or not os.path.exists(self._entry_path(key)):
+            return None
+        with np.load(self._entry_path(key)) as data:
+            return types.SimpleNamespace(**{f: float(data[f]) for f in "xyz"},
+                                         **{f: data[f] for f in KAK_FACTORS})
+
+    def _store(self, key: str, kak_result):
+        # Each writer fills its own temporary file and renames it into place,
+        # so concurrent workers never read or interleave a partial file
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            np.savez(f, **{name: getattr(kak_result, name) for name in "xyz"},
+                     **{name: np.asarray(getattr(kak_result, name)) for name in KAK_FACTORS})
+        os.replace(f.name, self._entry_path(key))
+
+    def get(self, matrix, decompose):
+        """KAK result of the matrix, calling decompose(matrix) only if neither memory nor disk has it."""
+        key = matrix_key(matrix)
+
+        kak_result = self._entries.get(key)
+        if kak_result is None:
+            kak_result = self._load(key)
+        if kak_result is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            kak_result = decompose(np.asarray(matrix, dtype=complex))
+            if self.directory:
+                self._store(key, kak_result)
+
+        self._entries[key] = kak_result
+        return kak_result
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
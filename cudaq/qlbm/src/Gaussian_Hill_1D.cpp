@@ -1,7 +1,13 @@
 #include <cudaq.h>
+#include <chrono>
 #include <cmath>
+#include <complex>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
 #include <iostream>
 #include <cstring>
+#include <vector>
 using namespace std;
 
 /*
@@ -12,13 +18,100 @@ using namespace std;
 
    Author: Will Buziak
    December 2025
+
+   Runs the same D1Q3 time step as poisson1D.py (exact mode): the ancilla
+   measurements are deferred onto two coin qubits, and because collision is
+   diagonal in the spatial basis and streaming is a permutation, every step
+   restarts from the square roots of the previous site populations.
+
+   Qubit layout: q[0] = select coin, q[1] = stream coin, q[2..] = spatial
+   register (first spatial qubit is the LSB of the site index), so the
+   state index is (site << 2) | coins.
+
+   Build:  nvq++ Gaussian_Hill_1D.cpp -o ../bin/gauss
+   Usage:  ./gauss [output prefix] [shots]
+
+   Output: <prefix>_density.bin (exact) and, if shots > 0,
+   <prefix>_sampled.bin. Each file is an int32 N, an int32 timesteps, then
+   (timesteps + 1) rows of N doubles, row t being the density after t steps.
 */
 
+// --- Kernels (one per phase, so each phase can be timed on its own) ---
+
+// State preparation: the padded amplitude vector has the coins in |00>
+__qpu__ void state_prep_kernel(vector<cudaq::complex> amplitudes) {
+  cudaq::qvector q(amplitudes);
+}
+
+// Collision: with a uniform collision vector the UCRY is a single ry
+__qpu__ void collision_kernel(cudaq::state *initial_state, double theta_weight, double theta_collision) {
+  cudaq::qvector q(initial_state);
+  ry(theta_weight, q[0]);
+  ry(theta_collision, q[1]);
+}
+
+// Streaming: +1 if (select, stream) = (1, 0), -1 if (1, 1)
+__qpu__ void streaming_kernel(cudaq::state *initial_state, int num_spatial_qubits) {
+  cudaq::qvector q(initial_state);
+
+  // Right shift, controlled on select = 1 and stream = 0
+  x(q[1]);
+  for (int i = num_spatial_qubits - 1; i > 0; i--) {
+    x<cudaq::ctrl>(q.front(2 + i), q[2 + i]);
+  }
+  x<cudaq::ctrl>(q.front(2), q[2]);
+  x(q[1]);
+
+  // Left shift, controlled on select = 1 and stream = 1
+  x<cudaq::ctrl>(q.front(2), q[2]);
+  for (int i = 1; i < num_spatial_qubits; i++) {
+    x<cudaq::ctrl>(q.front(2 + i), q[2 + i]);
+  }
+}
+
+__qpu__ void sampling_kernel(cudaq::state *initial_state) {
+  cudaq::qvector q(initial_state);
+  mz(q);
+}
+
+// --- Helpers ---
+
+double seconds_since(chrono::steady_clock::time_point start) {
+  return chrono::duration<double>(chrono::steady_clock::now() - start).count();
+}
+
+// Site populations of a full state, marginalizing the two coins
+vector<double> site_probabilities(cudaq::state &state, int N) {
+  vector<double> probabilities(N, 0.0);
+
+  for (size_t i = 0; i < (size_t) 4 * N; i++) {
+    probabilities[i >> 2] += norm(state[i]);
+  }
+  return probabilities;
+}
+
+void write_header(FILE *f, int N, int timesteps) {
+  int32_t header[2] = {N, timesteps};
+  fwrite(header, sizeof(int32_t), 2, f);
+}
+
+void write_row(FILE *f, const vector<double> &probabilities, double mass) {
+  vector<double> row(probabilities.size());
+
+  for (size_t i = 0; i < row.size(); i++) row[i] = probabilities[i] * mass;
+  fwrite(row.data(), sizeof(double), row.size(), f);
+}
+
 int main(int argc, char** argv) {
-  int N, timesteps, x, num_vel;
-  double psi, psi_ambient, sigma_0, u, c_s, D;
+  int N, timesteps, x, num_vel, num_spatial_qubits, shots;
+  double psi, psi_ambient, sigma_0, u, c_s, mass, theta_weight, theta_collision;
+  double t_prep, t_collision, t_streaming, t_sampling;
   vector <int> x_0;
-  
+  vector <double> density, probabilities, sampled;
+  vector <cudaq::complex> amplitudes;
+  string prefix;
+  FILE *density_file, *sampled_file;
+
   // Initialize domain & simulation parameters
   N = 128;            // Number of points in grid
   x_0.resize(N);      // Spatial grid
@@ -33,8 +126,99 @@ int main(int argc, char** argv) {
   u = .2;
   x = 50;
 
+  prefix = (argc > 1) ? argv[1] : "gauss";
+  shots = (argc > 2) ? atoi(argv[2]) : 0;
+  num_spatial_qubits = (int) log2(N);
+
+  if ((1 << num_spatial_qubits) != N || num_vel != 3) {
+    fprintf(stderr, "N must be a power of two and num_vel must be 3 (D1Q3).\n");
+    return 1;
+  }
+
   // Initialize scalar fields
+  density.resize(N);
+  mass = 0;
+  for (int i = 0; i < N; i++) {
+    x_0[i] = i;
+    density[i] = psi_ambient + psi * exp(-pow(x_0[i] - x, 2) / (2 * pow(sigma_0, 2)));
+    mass += density[i];
+  }
+
+  probabilities.resize(N);
+  for (int i = 0; i < N; i++) probabilities[i] = density[i] / mass;
+
+  // Same angles as computeconstantangles / computecollisionangle
+  theta_weight = 2 * acos(sqrt(2.0 / 3.0));
+  theta_collision = 2 * acos(sqrt(0.5 + 0.5 * u / (c_s * c_s)));
+
+  density_file = fopen((prefix + "_density.bin").c_str(), "wb");
+  sampled_file = (shots > 0) ? fopen((prefix + "_sampled.bin").c_str(), "wb") : NULL;
+  if (density_file == NULL || (shots > 0 && sampled_file == NULL)) {
+    fprintf(stderr, "Could not open output files with prefix %s\n", prefix.c_str());
+    return 1;
+  }
+
+  write_header(density_file, N, timesteps);
+  write_row(density_file, probabilities, mass);
+  if (sampled_file != NULL) {
+    write_header(sampled_file, N, timesteps);
+    write_row(sampled_file, probabilities, mass);
+  }
+
+  printf("--- Running CUDA-Q Gaussian Hill (D1Q3) ---\n");
+  printf("N: %d, Qubits: %d, Time Steps: %d, Shots: %d\n", N, num_spatial_qubits + 2, timesteps, shots);
+
+  t_prep = t_collision = t_streaming = t_sampling = 0;
+  amplitudes.resize(4 * N);
+
+  for (int t = 0; t < timesteps; t++) {
+    // 1. State preparation from the current populations
+    auto start = chrono::steady_clock::now();
+    for (int i = 0; i < N; i++) amplitudes[i << 2] = sqrt(probabilities[i]);
+    auto prepared = cudaq::get_state(state_prep_kernel, amplitudes);
+    t_prep += seconds_since(start);
+
+    // 2. Collision
+    start = chrono::steady_clock::now();
+    auto collided = cudaq::get_state(collision_kernel, &prepared, theta_weight, theta_collision);
+    t_collision += seconds_since(start);
+
+    // 3. Streaming
+    start = chrono::steady_clock::now();
+    auto streamed = cudaq::get_state(streaming_kernel, &collided, num_spatial_qubits);
+    t_streaming += seconds_since(start);
+
+    probabilities = site_probabilities(streamed, N);
+    write_row(density_file, probabilities, mass);
+
+    // 4. Sampling (the estimate a hardware run would see)
+    if (sampled_file != NULL) {
+      start = chrono::steady_clock::now();
+      auto counts = cudaq::sample(shots, sampling_kernel, &streamed);
+      sampled.assign(N, 0.0);
+      for (auto &[bits, count] : counts) {
+        int site = 0;
+        for (int j = 0; j < num_spatial_qubits; j++) {
+          if (bits[2 + j] == '1') site |= 1 << j;
+        }
+        sampled[site] += (double) count / shots;
+      }
+      t_sampling += seconds_since(start);
+      write_row(sampled_file, sampled, mass);
+    }
+  }
+
+  fclose(density_file);
+  if (sampled_file != NULL) fclose(sampled_file);
+
+  printf("\n--- Per-Phase Timings ---\n");
+  printf("%-12s %12s %16s\n", "phase", "total [s]", "per step [ms]");
+  printf("%-12s %12.4f %16.4f\n", "state prep", t_prep, 1e3 * t_prep / timesteps);
+  printf("%-12s %12.4f %16.4f\n", "collision", t_collision, 1e3 * t_collision / timesteps);
+  printf("%-12s %12.4f %16.4f\n", "streaming", t_streaming, 1e3 * t_streaming / timesteps);
+  printf("%-12s %12.4f %16.4f\n", "sampling", t_sampling, 1e3 * t_sampling / timesteps);
+  printf("\nWrote %s_density.bin\n", prefix.c_str());
+  if (shots > 0) printf("Wrote %s_sampled.bin\n", prefix.c_str());
 
-  
-  return 1;
+  return 0;
 }
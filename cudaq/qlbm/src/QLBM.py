@@ -1,6 +1,8 @@
 import numpy as np
 import cudaq
 
+from postprocess import counts_to_density
+
 # --- Utility Gates (Must be implemented as standard Python functions, 
 # --- operating within a kernel context)
 
@@ -162,25 +164,12 @@ def run_qlbm_d1q3(density: np.ndarray, advection_velocity: float, timesteps: int
     
     try:
         counts_result = cudaq.sample(kernel, shots=shots)
-        counts = counts_result.to_dict()
-        
-        # 3. Post-processing (as before)
-        probabilities = {state: count / shots for state, count in counts.items()}
-        
-        # Extract and scale the density (based on the spatial qubits)
-        # Spatial qubits are the LSBs in the measurement string.
-        
-        # Create a list of all 2^Nx possible spatial states
-        spatial_states = [format(i, f'0{num_spatial_qubits}b') for i in range(Nx)]
         
-        final_density = np.zeros(Nx)
-        for state, prob in probabilities.items():
-            # CUDA-Q measurement string is typically big-endian: (Ancilla)(Spatial bits)
-            spatial_part = state[1:] 
-            if spatial_part in spatial_states:
-                 # Convert binary string to integer index
-                 idx = int(spatial_part, 2)
-                 final_density[idx] += prob
+        # 3. Post-processing
+        # CUDA-Q measurement string is (Ancilla)(Spatial bits), with the
+        # first spatial qubit as the LSB of the site index.
+        counts, _ = counts_to_density(counts_result, num_spatial_qubits)
+        final_density = counts / shots
 
         # Scale by normalization constant
         final_density_scaled = final_density * normalization_constant**2
@@ -0,0 +1,77 @@
+import numpy as np
+
+# QFT-based (Draper) streaming for the builder kernels.
+#
+# The ripple shifts in poisson1D.py use an mcx chain with up to n-1
+# controls (plus the coins), which decomposes into O(n^2) Toffolis. In the
+# Fourier basis a +/-1 shift is a product of single-qubit phases, so the
+# streaming becomes QFT -> coin-controlled phases -> inverse QFT. Only
+# two-qubit controlled phases appear in the transforms, the left and right
+# shifts share one QFT pair, and the depth grows linearly in n.
+#
+# The first spatial qubit is the LSB, as for the ripple shifts.
+
+
+def apply_qft(kernel, qubits: list):
+    """QFT without the final swaps: qubit j ends up carrying the phase 2*pi*x / 2^(j+1)."""
+    for j in range(len(qubits) - 1, -1, -1):
+        kernel.h(qubits[j])
+        for k in range(j - 1, -1, -1):
+            kernel.cr1(np.pi / 2**(j - k), qubits[k], qubits[j])
+
+
+def apply_inverse_qft(kernel, qubits: list):
+    for j in range(len(qubits)):
+        for k in range(j):
+            kernel.cr1(-np.pi / 2**(j - k), qubits[k], qubits[j])
+        kernel.h(qubits[j])
+
+
+def apply_fourier_shift(kernel, qubits: list, controls: list, direction: int):
+    """Adds direction (mod 2^N) to a register already in the Fourier basis, controlled on `controls`."""
+    for j in range(len(qubits)):
+        if direction % 2**(j + 1) == 0:
+            continue
+        angle = direction * np.pi / 2**j
+        if controls:
+            kernel.cr1(angle, controls, qubits[j])
+        else:
+            kernel.r1(angle, qubits[j])
+
+
+def apply_qft_streaming(kernel, spatial_qubits: list, select_coin, stream_coin):
+    """
+    Streams right if (select, stream) = (1, 0) and left if (1, 1), sharing one QFT pair.
+    """
+    apply_qft(kernel, spatial_qubits)
+
+    # +1 on select, then -2 when the stream coin is also set
+    apply_fourier_shift(kernel, spatial_qubits, [select_coin], +1)
+    apply_fourier_shift(kernel, spatial_qubits, [select_coin, stream_coin], -2)
+
+    apply_inverse_qft(kernel, spatial_qubits)
+
+
+def apply_register_adder(kernel, target_qubits: list, addend_qubits: list, method: str = "ripple"):
+    """
+    target += addend (mod 2^N), with both registers LSB first.
+
+    "ripple" adds 2^j as an increment of target[j:] controlled on addend[j];
+    "qft" applies every addend bit as a controlled phase inside one QFT pair.
+    """
+    num_qubits = len(target_qubits)
+    num_addend = min(len(addend_qubits), num_qubits)
+
+    if method == "qft":
+        apply_qft(kernel, target_qubits)
+        for j in range(num_addend):
+            for i in range(j, num_qubits):
+                kernel.cr1(np.pi / 2**(i - j), addend_qubits[j], target_qubits[i])
+        apply_inverse_qft(kernel, target_qubits)
+        return
+
+    for j in range(num_addend):
+        sub_register = target_qubits[j:]
+        for i in range(len(sub_register) - 1, 0, -1):
+            kernel.cx([addend_qubits[j]] + sub_register[0:i], sub_register[i])
+        kernel.cx(addend_qubits[j], sub_register[0])
@@ -0,0 +1,30 @@
+import numpy as np
+
+# D1Q3 rotation angles and lattice checks shared by the quantum kernels in
+# poisson1D.py and the classical reference in classical.py. Kept free of
+# cudaq so the classical engine starts without the CUDA-Q import.
+
+
+def is_power_of_two(n):
+    return (n > 0) and (n & (n - 1)) == 0
+
+def computecollisionangle(microscopic_velocities: int, u_LBM: float):
+    c_s = 1/np.sqrt(3)
+
+    if(microscopic_velocities==3):
+        collision_angle = np.sqrt(0.5+0.5*u_LBM/c_s**2)
+        theta_collision= 2*np.arccos(collision_angle)
+    elif(microscopic_velocities==9):
+        raise NotImplementedError("D2Q9 calculations are complex and omitted for this 1D example.")
+    else:
+        raise ValueError("microscopic_velocities must be either 3 or 9.")
+    return theta_collision
+    
+def computeconstantangles(microscopic_velocities: int):
+    if (microscopic_velocities==3):
+        theta_weight = 2*np.arccos(np.sqrt(2/3))
+    elif (microscopic_velocities==9):
+        raise NotImplementedError("D2Q9 calculations are complex and omitted for this 1D example.")
+    else:
+        raise ValueError("microscopic_velocities must be either 3 or 9.")
+    return theta_weight
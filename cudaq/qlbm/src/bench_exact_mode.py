@@ -0,0 +1,45 @@
+import sys
+import time
+import numpy as np
+
+from poisson1D import run_qlbm_d1q3
+from classical import run_classical_d1q3
+
+# Error vs. wall time of mode="sample" against mode="exact".
+# Usage: python bench_exact_mode.py [Nx] [timesteps]
+
+def gaussian_density(Nx: int):
+    x = np.linspace(0, Nx - 1, Nx)
+    raw_density = np.exp(-((x - Nx/2)**2) / 2)
+    return raw_density / np.sum(raw_density)
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    Nx = int(sys.argv[1]) if 1 < len(sys.argv) else 8
+    timesteps = int(sys.argv[2]) if 2 < len(sys.argv) else 1
+    advection_velocity = 0.1
+    density = gaussian_density(Nx)
+
+    reference = run_classical_d1q3(density, advection_velocity, timesteps)
+
+    exact_density, exact_time = timed(run_qlbm_d1q3, density, advection_velocity, timesteps, 0, mode="exact")
+    rows = [("exact", "-", exact_time, np.max(np.abs(exact_density - reference)))]
+
+    for shots in (100, 1000, 10000, 100000):
+        try:
+            sampled_density, sample_time = timed(run_qlbm_d1q3, density, advection_velocity, timesteps, shots)
+        except Exception as e:
+            print(f"Sampled mode failed at {shots} shots: {e}")
+            continue
+        if sampled_density is None:
+            continue
+        rows.append(("sample", shots, sample_time, np.max(np.abs(sampled_density - reference))))
+
+    print(f"\n--- Error vs. Wall Time (Nx={Nx}, timesteps={timesteps}) ---")
+    print(f"{'mode':>8} {'shots':>8} {'time [s]':>10} {'max |err|':>12}")
+    for mode, shots, elapsed, error in rows:
+        print(f"{mode:>8} {shots:>8} {elapsed:>10.4f} {error:>12.3e}")
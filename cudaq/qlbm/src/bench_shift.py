@@ -0,0 +1,109 @@
+import sys
+import time
+import numpy as np
+import cudaq
+
+from poisson1D import apply_controlled_shift, build_qlbm_step_kernel
+from adders import apply_qft_streaming
+
+# Depth and gate count of the coin-controlled streaming step: ripple mcx
+# shifts vs. the QFT adder, for n = 3..20 spatial qubits.
+# Usage: python bench_shift.py [max_n] [max_simulated_n]
+
+class GateRecorder:
+    """
+    Stands in for a kernel builder and records every gate it is handed.
+
+    Toffoli/CNOT counts use the textbook decompositions with clean ancillas:
+    an m-controlled X costs 2m-3 Toffolis (m >= 2), an m-controlled phase
+    computes the AND of its controls into an ancilla and back (2(m-1)
+    Toffolis) around one controlled phase (2 CNOTs), and a Toffoli costs
+    6 CNOTs.
+    """
+
+    def __init__(self):
+        self.gates = 0
+        self.toffolis = 0
+        self.cnots = 0
+        self.max_controls = 0
+        self.layers = {}
+
+    def _record(self, controls: list, target):
+        qubits = list(controls) + [target]
+        layer = 1 + max(self.layers.get(q, 0) for q in qubits)
+        for q in qubits:
+            self.layers[q] = layer
+        self.gates += 1
+        self.max_controls = max(self.max_controls, len(controls))
+
+    def _controls(self, controls):
+        return list(controls) if isinstance(controls, list) else [controls]
+
+    def h(self, target):
+        self._record([], target)
+
+    def x(self, target):
+        self._record([], target)
+
+    def r1(self, angle, target):
+        self._record([], target)
+
+    def cx(self, controls, target):
+        controls = self._controls(controls)
+        self._record(controls, target)
+        m = len(controls)
+        if m == 1:
+            self.cnots += 1
+        else:
+            self.toffolis += 2 * m - 3
+            self.cnots += 6 * (2 * m - 3)
+
+    def cr1(self, angle, controls, target):
+        controls = self._controls(controls)
+        self._record(controls, target)
+        m = len(controls)
+        if m > 1:
+            self.toffolis += 2 * (m - 1)
+            self.cnots += 6 * 2 * (m - 1)
+        self.cnots += 2
+
+    def depth(self):
+        return max(self.layers.values(), default=0)
+
+
+def record_ripple(n: int):
+    recorder = GateRecorder()
+    spatial_qubits, select_coin, stream_coin = list(range(n)), n, n + 1
+    recorder.x(stream_coin)
+    apply_controlled_shift(recorder, spatial_qubits, [select_coin, stream_coin], +1)
+    recorder.x(stream_coin)
+    apply_controlled_shift(recorder, spatial_qubits, [select_coin, stream_coin], -1)
+    return recorder
+
+
+def record_qft(n: int):
+    recorder = GateRecorder()
+    apply_qft_streaming(recorder, list(range(n)), n, n + 1)
+    return recorder
+
+
+def time_step_kernel(n: int, shift: str, repeats: int = 3):
+    kernel = build_qlbm_step_kernel(n, (), shift)
+    amplitudes = (np.ones(2**n) / np.sqrt(2**n)).astype(complex).tolist()
+    cudaq.get_state(kernel, 1.0, [0.5], amplitudes)  # JIT compile
+    start = time.perf_counter()
+    for _ in range(repeats):
+        cudaq.get_state(kernel, 1.0, [0.5], amplitudes)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    max_n = int(sys.argv[1]) if 1 < len(sys.argv) else 20
+    max_simulated_n = int(sys.argv[2]) if 2 < len(sys.argv) else 12
+
+    print(f"{'n':>3} | {'shift':>6} {'gates':>6} {'depth':>6} {'max ctrl':>8} {'toffoli':>8} {'cnot est':>9} {'sim [s]':>9}")
+    for n in range(3, max_n + 1):
+        for shift, recorder in (("ripple", record_ripple(n)), ("qft", record_qft(n))):
+            sim_time = f"{time_step_kernel(n, shift):.4f}" if n <= max_simulated_n else "-"
+            print(f"{n:>3} | {shift:>6} {recorder.gates:>6} {recorder.depth():>6} {recorder.max_controls:>8} "
+                  f"{recorder.toffolis:>8} {recorder.cnots:>9} {sim_time:>9}")
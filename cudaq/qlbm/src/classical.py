@@ -0,0 +1,127 @@
+import numpy as np
+
+from angles import computecollisionangle, computeconstantangles, is_power_of_two
+
+# Classical NumPy reference for the D1Q3 QLBM circuit in poisson1D.py.
+#
+# Every gate that touches the spatial register is either a permutation
+# (the streaming shifts) or block-diagonal in the computational basis
+# (the UCRY collision), and the final readout is a computational-basis
+# measurement. The populations |amp(x)|^2 therefore evolve as a Markov
+# chain, and the expected density after each time step is
+#
+#     rho'(x) = w_rest * rho(x) + (w_right * rho)(x - 1) + (w_left * rho)(x + 1)
+#
+# with the weights read off the same rotation angles the kernel uses.
+#
+# Each step is a few passes over the (B, Nx) array, so the engine is
+# memory-bound: B=4, Nx=2^20, T=10 takes about 0.6 s with method="roll"
+# and 0.3 s with method="fft" on one CPU core, rather than milliseconds.
+
+
+# --- 1. Weights ---
+
+def d1q3_weights(advection_velocity: float, Nx: int, theta_collision_vector: np.ndarray = None):
+    """
+    Returns the per-site (rest, right, left) weights of one D1Q3 time step.
+    """
+    microscopic_velocities = 3
+    theta_weight = computeconstantangles(microscopic_velocities)
+
+    if theta_collision_vector is None:
+        single_collision_angle = computecollisionangle(microscopic_velocities, advection_velocity)
+        theta_collision_vector = np.full(Nx, single_collision_angle)
+    theta_collision_vector = np.asarray(theta_collision_vector, dtype=float).reshape(-1)
+
+    if theta_collision_vector.shape[0] != Nx:
+        raise ValueError("theta_collision_vector must have one angle per lattice site.")
+
+    # ry(theta_weight) on the ancilla: |1> selects the moving populations
+    p_moving = np.sin(theta_weight / 2)**2
+    # UCRY on the ancilla: |0> streams right, |1> streams left
+    p_right = np.cos(theta_collision_vector / 2)**2
+
+    w_rest = np.full(Nx, 1 - p_moving)
+    w_right = p_moving * p_right
+    w_left = p_moving * (1 - p_right)
+
+    return w_rest, w_right, w_left
+
+
+# --- 2. Reference Engine ---
+
+def run_classical_d1q3(density: np.ndarray,
+                       advection_velocity: float,
+                       timesteps: int,
+                       theta_collision_vector: np.ndarray = None,
+                       method: str = "roll"):
+    """
+    Exact expected density of run_qlbm_d1q3 without sampling.
+
+    density may be a single profile (Nx,) or a batch (B, Nx); the result
+    has the same shape. method="roll" steps the lattice with periodic
+    shifts, method="fft" applies all time steps at once in Fourier space and is
+    only valid for a uniform collision vector.
+    """
+    density = np.asarray(density, dtype=float)
+    squeeze = density.ndim == 1
+    rho = np.atleast_2d(density)
+
+    if rho.ndim != 2 or not is_power_of_two(rho.shape[1]):
+        raise ValueError("Density must be (Nx,) or (B, Nx) with power-of-two Nx.")
+
+    Nx = rho.shape[1]
+    w_rest, w_right, w_left = d1q3_weights(advection_velocity, Nx, theta_collision_vector)
+
+    if method == "roll":
+        # Periodic shifts as slice adds into preallocated buffers, so a step allocates no temporaries
+        rho = rho.copy()
+        streamed = np.empty_like(rho)
+        moving = np.empty_like(rho)
+        for _ in range(timesteps):
+            np.multiply(w_rest, rho, out=streamed)
+            np.multiply(w_right, rho, out=moving)
+            streamed[:, 1:] += moving[:, :-1]
+            streamed[:, 0] += moving[:, -1]
+            np.multiply(w_left, rho, out=moving)
+            streamed[:, :-1] += moving[:, 1:]
+            streamed[:, -1] += moving[:, 0]
+            rho, streamed = streamed, rho
+
+    elif method == "fft":
+        if not (np.allclose(w_right, w_right[0]) and np.allclose(w_left, w_left[0])):
+            raise ValueError("method='fft' requires a uniform collision vector.")
+
+        # Transfer function of one step: w_rest + w_right*e^{-ik} + w_left*e^{ik}
+        # (real input, so only the non-negative frequencies are needed)
+        k = 2 * np.pi * np.fft.rfftfreq(Nx)
+        transfer = w_rest[0] + w_right[0] * np.exp(-1j * k) + w_left[0] * np.exp(1j * k)
+        rho = np.fft.irfft(np.fft.rfft(rho, axis=1) * transfer**timesteps, n=Nx, axis=1)
+
+    else:
+        raise ValueError("method must be either 'roll' or 'fft'.")
+
+    return rho[0] if squeeze else rho
+
+
+# --- 3. Example Execution Block ---
+
+if __name__ == "__main__":
+    import time
+
+    Nx = 2**20
+    B = 4
+    advection_velocity = 0.1
+    timesteps = 10
+
+    x = np.linspace(0, Nx - 1, Nx)
+    centres = np.linspace(Nx / 4, 3 * Nx / 4, B)[:, None]
+    raw_density = np.exp(-((x - centres)**2) / (2 * (Nx / 64)**2))
+    density = raw_density / np.sum(raw_density, axis=1, keepdims=True)
+
+    for method in ("roll", "fft"):
+        start = time.perf_counter()
+        final_density = run_classical_d1q3(density, advection_velocity, timesteps, method=method)
+        elapsed = time.perf_counter() - start
+        print(f"{method:>4}: B={B}, Nx={Nx}, T={timesteps} in {elapsed*1e3:.1f} ms, "
+              f"mass = {np.sum(final_density, axis=1)}")
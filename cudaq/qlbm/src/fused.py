@@ -0,0 +1,134 @@
+import numpy as np
+import cudaq
+
+from poisson1D import KernelCache, SHIFT_METHODS, apply_qlbm_time_step, prepare_qlbm_parameters
+from postprocess import counts_to_density
+from ucry import multiplexed_ry_arguments
+
+# Fused multi-timestep D1Q3 kernel without mid-circuit measurements.
+#
+# build_qlbm_kernel resets its two coin qubits between time steps, which
+# forces per-shot trajectory simulation (explicit_measurements=True). Here
+# every time step gets its own (select, stream) coin pair instead, so all
+# ancilla measurements are deferred to the end and discarded: the circuit
+# is unitary, one statevector carries the whole run and cudaq.sample draws
+# every shot from it. The coins shift the spatial register directly, for
+# uniform and site-dependent collision vectors alike.
+#
+# The circuit needs log2(Nx) + 2T qubits, so statevector simulation limits
+# it to a few time steps on small lattices (T=100 at Nx=128 would need 207
+# qubits). Long runs go through run_qlbm_d1q3, whose sampled mode stays on
+# log2(Nx) + 2 qubits.
+
+
+def build_fused_qlbm_kernel(num_spatial_qubits: int, timesteps: int, is_uniform: bool,
+                            collision_controls: tuple = (), shift: str = "ripple", measure: bool = True):
+    """
+    Builds the T-step kernel with one coin pair per step; arguments as for build_qlbm_kernel.
+
+    The spatial register holds the lowest qubits, so marginalizing the
+    coins is a reshape of the state.
+    Build with measure=False for `cudaq.get_state`, which would otherwise
+    collapse onto a single measured outcome.
+    """
+    kernel, theta_weight, collision_alphas, amplitudes = cudaq.make_kernel(float, list[float], list[complex])
+
+    if is_uniform:
+        spatial = kernel.qalloc(num_spatial_qubits)
+        kernel.h(spatial)
+    else:
+        spatial = kernel.qalloc(amplitudes)
+    spatial_qubits = [spatial[i] for i in range(num_spatial_qubits)]
+
+    coins = kernel.qalloc(2 * timesteps)
+
+    for step in range(timesteps):
+        apply_qlbm_time_step(kernel, spatial_qubits, coins[2 * step], coins[2 * step + 1],
+                             theta_weight, collision_alphas, collision_controls, shift)
+
+    if measure:
+        kernel.mz(spatial)
+
+    return kernel
+
+# Keyed on (num_spatial_qubits, timesteps, is_uniform, collision_controls, shift, measure)
+fused_qlbm_kernel_cache = KernelCache(build_fused_qlbm_kernel)
+
+
+def run_fused_qlbm_d1q3(density: np.ndarray, advection_velocity: float, timesteps: int, shots: int,
+                        mode: str = "sample", shift: str = "ripple", theta_collision_vector: np.ndarray = None):
+    """
+    Same result as run_qlbm_d1q3, from a single unitary circuit over all time steps.
+
+    The circuit has 2 * timesteps coin qubits, so this is only practical
+    for small T; see the module comment.
+
+    mode="sample" draws `shots` samples from one statevector simulation;
+    mode="exact" reads the probabilities from `cudaq.get_state`.
+    theta_collision_vector overrides the uniform collision angles with one
+    angle per site.
+    """
+    if mode not in ("sample", "exact"):
+        raise ValueError("mode must be either 'sample' or 'exact'.")
+    if shift not in SHIFT_METHODS:
+        raise ValueError(f"shift must be one of {SHIFT_METHODS}.")
+
+    (num_spatial_qubits, is_uniform, normalization_constant,
+     theta_weight, uniform_collision_vector, density_sqrt_normalized) = prepare_qlbm_parameters(density, advection_velocity)
+    Nx = 2**num_spatial_qubits
+
+    if theta_collision_vector is None:
+        theta_collision_vector = uniform_collision_vector
+    elif np.asarray(theta_collision_vector).shape != (Nx,):
+        raise ValueError("theta_collision_vector must have one angle per lattice site.")
+
+    collision_controls, collision_alphas = multiplexed_ry_arguments(theta_collision_vector)
+    amplitudes = density_sqrt_normalized.astype(complex).tolist()
+
+    kernel = fused_qlbm_kernel_cache.get(num_spatial_qubits, timesteps, is_uniform,
+                                         collision_controls, shift, mode == "sample")
+
+    if mode == "exact":
+        state = np.array(cudaq.get_state(kernel, theta_weight, collision_alphas, amplitudes))
+        # Marginalize the coins (the high bits of the state index)
+        probabilities = (np.abs(state)**2).reshape(-1, Nx).sum(axis=0)
+        return probabilities / np.sum(probabilities) * normalization_constant**2
+
+    counts_result = cudaq.sample(kernel, theta_weight, collision_alphas, amplitudes, shots_count=shots)
+    final_density, total_valid_counts = counts_to_density(counts_result, num_spatial_qubits, ancilla="none")
+
+    return final_density / total_valid_counts * normalization_constant**2
+
+
+if __name__ == "__main__":
+    import time
+    from classical import run_classical_d1q3
+    from poisson1D import run_qlbm_d1q3
+
+    Nx = 16
+    timesteps = 4
+    advection_velocity = 0.2
+    shots = 20000
+
+    x = np.arange(Nx)
+    raw_density = 0.1 + 0.3 * np.exp(-((x - 6)**2) / (2 * 2**2))
+    density = raw_density / np.sum(raw_density)
+
+    # Uniform collision and a site-dependent one
+    site_collision_vector = np.linspace(1.2, 1.8, Nx)
+    for label, collision_vector in (("uniform", None), ("per-site", site_collision_vector)):
+        reference = run_classical_d1q3(density, advection_velocity, timesteps, collision_vector)
+
+        for mode in ("exact", "sample"):
+            for shift in SHIFT_METHODS:
+                start = time.perf_counter()
+                final_density = run_fused_qlbm_d1q3(density, advection_velocity, timesteps, shots,
+                                                    mode, shift, collision_vector)
+                elapsed = time.perf_counter() - start
+                print(f"{label:>8} / {mode:>6} / {shift:>6}: {elapsed:.3f} s, "
+                      f"max |err| vs. classical = {np.max(np.abs(final_density - reference)):.3e}")
+
+    # Step-by-step statevectors on log2(Nx) + 2 qubits, for comparison
+    start = time.perf_counter()
+    run_qlbm_d1q3(density, advection_velocity, timesteps, shots)
+    print(f"run_qlbm_d1q3: {time.perf_counter() - start:.3f} s")
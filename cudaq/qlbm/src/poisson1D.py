@@ -1,34 +1,17 @@
 import numpy as np
 import cudaq
+from collections import OrderedDict
 
-# --- 1. Classical Utility Functions (Unchanged) ---
+from angles import computecollisionangle, computeconstantangles, is_power_of_two
+from postprocess import counts_to_density
+from ucry import apply_multiplexed_ry, multiplexed_ry_arguments
+from adders import apply_qft_streaming
+from stateprep import apply_state_preparation, prepare_state_decomposition
 
-def is_power_of_two(n):
-    return (n > 0) and (n & (n - 1)) == 0
+SHIFT_METHODS = ("ripple", "qft")
+STATE_PREP_METHODS = ("vector", "gates")
 
-def computecollisionangle(microscopic_velocities: int, u_LBM: float):
-    c_s = 1/np.sqrt(3)
-
-    if(microscopic_velocities==3):
-        collision_angle = np.sqrt(0.5+0.5*u_LBM/c_s**2)
-        theta_collision= 2*np.arccos(collision_angle)
-    elif(microscopic_velocities==9):
-        raise NotImplementedError("D2Q9 calculations are complex and omitted for this 1D example.")
-    else:
-        raise ValueError("microscopic_velocities must be either 3 or 9.")
-    return theta_collision
-    
-def computeconstantangles(microscopic_velocities: int):
-    if (microscopic_velocities==3):
-        theta_weight = 2*np.arccos(np.sqrt(2/3))
-    elif (microscopic_velocities==9):
-        raise NotImplementedError("D2Q9 calculations are complex and omitted for this 1D example.")
-    else:
-        raise ValueError("microscopic_velocities must be either 3 or 9.")
-    return theta_weight
-
-
-# --- 2. Gate Definitions (Unchanged) ---
+# --- 1. Gate Definitions (Unchanged) ---
 
 def get_right_shift_gate(qubits: cudaq.qvector, index_first_qubit: int, num_qubits: int):
     """Implements the cyclic right shift (bit-wise $+1 \pmod{2^N}$ on spatial register)."""
@@ -76,82 +59,225 @@ def apply_ucry_gate(qubits: cudaq.qvector, indices: list[int], angles: np.ndarra
             x(q) 
 
 
-# --- 3. Main QLBM Kernel (Circuit Definition) ---
+# --- 2. Parameterized Kernels ---
+
+def apply_controlled_shift(kernel, spatial_qubits: list, controls: list, direction: int):
+    """Applies the cyclic shift ($\pm 1 \pmod{2^N}$) on the spatial register, controlled on `controls`."""
+    num_qubits = len(spatial_qubits)
+    targets = list(range(num_qubits - 1, 0, -1)) if direction > 0 else list(range(1, num_qubits))
+
+    if direction < 0:
+        kernel.cx(controls, spatial_qubits[0])
+
+    for i in targets:
+        kernel.cx(controls + spatial_qubits[0:i], spatial_qubits[i])
 
-@cudaq.kernel
-def qlbm_time_step_kernel(
-    qubit_count: int, 
-    timesteps: int, 
-    theta_weight: float, 
-    theta_collision_vector: np.ndarray, 
-    initial_density_vector: np.ndarray,
-    is_uniform: bool
-):
+    if direction > 0:
+        kernel.cx(controls, spatial_qubits[0])
+
+def apply_qlbm_time_step(kernel, spatial_qubits: list, select_coin, stream_coin,
+                         theta_weight, collision_alphas, collision_controls: tuple, shift: str = "ripple"):
     """
-    Main CUDA-Q kernel performing the QLBM simulation for D1Q3.
+    One D1Q3 time step with both ancilla measurements deferred onto two coin qubits.
+
+    The collision UCRY is the Gray-code multiplexor over `collision_controls`
+    (see ucry.py), with `collision_alphas` its rotation angles. shift selects
+    the mcx ripple shifts or the QFT-based streaming from adders.py.
     """
-    
-    qubits = cudaq.qvector(qubit_count)
-    
-    # Qubit mapping constants
-    ancilla_qubit = qubits[0]
+    # 1. Select f_0 (rest) or f_1+f_2 (moving)
+    kernel.ry(theta_weight, select_coin)
+
+    # 2. Collision Operation (site-indexed UCRY on the stream coin)
+    apply_multiplexed_ry(kernel, [spatial_qubits[j] for j in collision_controls], stream_coin, collision_alphas)
+
+    # 3. Streaming, controlled on the coins instead of measured outcomes
+    if shift == "qft":
+        apply_qft_streaming(kernel, spatial_qubits, select_coin, stream_coin)
+        return
+
+    kernel.x(stream_coin)
+    apply_controlled_shift(kernel, spatial_qubits, [select_coin, stream_coin], +1)
+    kernel.x(stream_coin)
+    apply_controlled_shift(kernel, spatial_qubits, [select_coin, stream_coin], -1)
+
+def build_qlbm_step_kernel(num_spatial_qubits: int, collision_controls: tuple = (), shift: str = "ripple"):
+    """
+    Builds a single D1Q3 time step as a unitary kernel, so `cudaq.get_state` is exact.
+
+    Arguments: theta_weight, the collision multiplexor angles (from
+    multiplexed_ry_arguments, which also gives collision_controls) and the
+    spatial amplitudes. The spatial register holds the lowest qubits, with
+    the first spatial qubit as the LSB of the site index.
+    """
+    kernel, theta_weight, collision_alphas, amplitudes = cudaq.make_kernel(float, list[float], list[complex])
+
+    spatial = kernel.qalloc(amplitudes)
+    select_coin = kernel.qalloc()
+    stream_coin = kernel.qalloc()
+    spatial_qubits = [spatial[i] for i in range(num_spatial_qubits)]
+
+    apply_qlbm_time_step(kernel, spatial_qubits, select_coin, stream_coin,
+                         theta_weight, collision_alphas, collision_controls, shift)
+
+    return kernel
+
+def build_qlbm_kernel(qubit_count: int, timesteps: int, is_uniform: bool,
+                      collision_controls: tuple = (), shift: str = "ripple", state_prep=None):
+    """
+    Builds the full sampled QLBM circuit with the same arguments as the step kernel.
+
+    Each step defers the ancilla measurements onto the two coin qubits and
+    then resets them, which discards the coins exactly as measuring them
+    would, so every step reuses the same pair and the circuit needs only
+    (qubit_count - 1) + 2 qubits. Only the spatial register is measured.
+    With timesteps > 1, sample it with explicit_measurements=True (one
+    simulation per shot): otherwise CUDA-Q simulates the circuit once and
+    every shot shares the outcome of the resets. run_qlbm_d1q3 avoids that
+    cost by sampling a one-step kernel after propagate_to_last_step.
+    If state_prep (a stateprep.StatePreparation) is given, a non-uniform
+    density is encoded with gates and the amplitudes argument is ignored.
+    """
+    kernel, theta_weight, collision_alphas, amplitudes = cudaq.make_kernel(float, list[float], list[complex])
     num_spatial_qubits = qubit_count - 1
-    index_first_spatial = 1
-    spatial_qubit_indices = list(range(1, qubit_count))
 
     # --- 1. Initialization (State Preparation) ---
     if is_uniform:
-        for i in spatial_qubit_indices:
-            h(qubits[i]) 
+        spatial = kernel.qalloc(num_spatial_qubits)
+        kernel.h(spatial)
+    elif state_prep is not None:
+        spatial = kernel.qalloc(num_spatial_qubits)
+        apply_state_preparation(kernel, [spatial[i] for i in range(num_spatial_qubits)], state_prep)
     else:
-        # --- FIX APPLIED HERE: Removed 'cudaq.' ---
-        prep = StatePreparer(initial_density_vector)
-        prep.apply_to(qubits.slice(index_first_spatial, qubit_count))
+        spatial = kernel.qalloc(amplitudes)
+    spatial_qubits = [spatial[i] for i in range(num_spatial_qubits)]
 
-    # --- 2. Time Step Loop (Unchanged) ---
-    for _ in range(timesteps):
-        # 1. Select f_0 (rest) or f_1+f_2 (moving)
-        ry(theta_weight, ancilla_qubit) 
-        
-        result_select = measure(ancilla_qubit) 
-        
-        with cudaq.if_ctrl(result_select, 1):
-            
-            reset(ancilla_qubit) 
-            
-            # 2. Collision Operation
-            all_qubit_indices = list(range(qubit_count))
-            apply_ucry_gate(qubits, all_qubit_indices, theta_collision_vector)
-            
-            # 3. Streaming Selection (f_1 or f_2)
-            result_stream = measure(ancilla_qubit) 
-            
-            with cudaq.if_ctrl(result_stream, 0):
-                get_right_shift_gate(qubits, index_first_spatial, num_spatial_qubits)
-            
-            with cudaq.else_ctrl():
-                reset(ancilla_qubit) 
-                get_left_shift_gate(qubits, index_first_spatial, num_spatial_qubits)
+    # --- 2. Time Step Loop ---
+    select_coin = kernel.qalloc()
+    stream_coin = kernel.qalloc()
+    for step in range(timesteps):
+        if step > 0:
+            kernel.reset(select_coin)
+            kernel.reset(stream_coin)
+        apply_qlbm_time_step(kernel, spatial_qubits, select_coin, stream_coin,
+                             theta_weight, collision_alphas, collision_controls, shift)
 
     # --- 3. Final Measurement ---
-    mz(qubits) 
+    kernel.mz(spatial)
 
+    return kernel
 
-# --- 4. Execution Wrapper (Unchanged) ---
+class KernelCache:
+    """
+    LRU cache of built kernels, keyed by the arguments of `builder`.
 
-def run_qlbm_d1q3(density: np.ndarray, advection_velocity: float, timesteps: int, shots: int):
+    Builder kernels are JIT-compiled on first launch and reused for any
+    runtime arguments afterwards, so a hit also skips recompilation.
     """
-    Sets up classical parameters, performs the classical checks, and executes the QLBM kernel.
+
+    def __init__(self, builder, maxsize: int = 16):
+        self.builder = builder
+        self.maxsize = maxsize
+        self.kernels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, *key):
+        if key in self.kernels:
+            self.hits += 1
+            self.kernels.move_to_end(key)
+            return self.kernels[key]
+
+        self.misses += 1
+        kernel = self.builder(*key)
+        self.kernels[key] = kernel
+        if len(self.kernels) > self.maxsize:
+            self.kernels.popitem(last=False)
+            self.evictions += 1
+        return kernel
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self.kernels), "hit_rate": self.hit_rate()}
+
+    def clear(self):
+        self.kernels.clear()
+        self.hits = self.misses = self.evictions = 0
+
+# Keyed on (qubit_count, timesteps, is_uniform, collision_controls, shift, state_prep)
+# and (num_spatial_qubits, collision_controls, shift)
+qlbm_kernel_cache = KernelCache(build_qlbm_kernel)
+qlbm_step_kernel_cache = KernelCache(build_qlbm_step_kernel)
+
+def exact_qlbm_probabilities(num_spatial_qubits: int,
+                             timesteps: int,
+                             theta_weight: float,
+                             theta_collision_vector: np.ndarray,
+                             density_sqrt_normalized: np.ndarray,
+                             shift: str = "ripple"):
+    """
+    Site probabilities after `timesteps` steps, read from `cudaq.get_state`.
+
+    Collision is diagonal in the spatial basis and streaming is a permutation,
+    so the site populations do not depend on spatial coherences. Each step
+    therefore restarts from the square roots of the previous populations.
+    """
+    Nx = 2**num_spatial_qubits
+    collision_controls, collision_alphas = multiplexed_ry_arguments(theta_collision_vector)
+    kernel = qlbm_step_kernel_cache.get(num_spatial_qubits, collision_controls, shift)
+
+    probabilities = np.abs(density_sqrt_normalized)**2
+    for _ in range(timesteps):
+        amplitudes = np.sqrt(probabilities).astype(complex).tolist()
+        state = np.array(cudaq.get_state(kernel, theta_weight, collision_alphas, amplitudes))
+        # Marginalize the two coin qubits (the high bits of the state index)
+        probabilities = (np.abs(state)**2).reshape(-1, Nx).sum(axis=0)
+
+    return probabilities / np.sum(probabilities)
+
+def propagate_to_last_step(num_spatial_qubits: int,
+                           timesteps: int,
+                           is_uniform: bool,
+                           theta_weight: float,
+                           theta_collision_vector: np.ndarray,
+                           density_sqrt_normalized: np.ndarray,
+                           shift: str = "ripple"):
+    """
+    Runs all but the last time step as in exact_qlbm_probabilities.
+
+    Returns (is_uniform, amplitudes) for a one-step kernel. Only the site
+    populations carry over between steps, so sampling that kernel gives
+    the same distribution as the full T-step circuit, while one statevector
+    on (num_spatial_qubits + 2) qubits serves all shots.
+    """
+    if timesteps <= 1:
+        return is_uniform, density_sqrt_normalized
+
+    probabilities = exact_qlbm_probabilities(num_spatial_qubits, timesteps - 1, theta_weight,
+                                             theta_collision_vector, density_sqrt_normalized, shift)
+    return bool(np.allclose(probabilities, probabilities[0])), np.sqrt(probabilities)
+
+
+# --- 3. Execution Wrapper ---
+
+def prepare_qlbm_parameters(density: np.ndarray, advection_velocity: float):
+    """
+    Performs the classical checks and computes the kernel arguments for one run.
+
+    Returns (num_spatial_qubits, is_uniform, normalization_constant,
+    theta_weight, theta_collision_vector, density_sqrt_normalized).
     """
-    
     if density.ndim != 1 or not is_power_of_two(density.shape[0]):
         raise ValueError("Density must be 1D with power-of-two size.")
         
     Nx = density.shape[0]
     num_spatial_qubits = int(np.log2(Nx))
-    qubit_count = num_spatial_qubits + 1
     
-    is_uniform = np.allclose(density, density[0])
+    is_uniform = bool(np.allclose(density, density[0]))
     
     density_sqrt = np.sqrt(density)
     normalization_constant = np.linalg.norm(density_sqrt)
@@ -162,37 +288,69 @@ def run_qlbm_d1q3(density: np.ndarray, advection_velocity: float, timesteps: int
     single_collision_angle = computecollisionangle(microscopic_velocities, advection_velocity)
     theta_collision_vector = np.full(Nx, single_collision_angle) 
 
-    # 2. Instantiate and Run the Kernel
-    kernel = qlbm_time_step_kernel(
-        qubit_count, 
-        timesteps, 
-        theta_weight, 
-        theta_collision_vector, 
-        density_sqrt_normalized,
-        is_uniform 
-    )
+    return (num_spatial_qubits, is_uniform, normalization_constant,
+            theta_weight, theta_collision_vector, density_sqrt_normalized)
+
+def run_qlbm_d1q3(density: np.ndarray, advection_velocity: float, timesteps: int, shots: int,
+                  mode: str = "sample", shift: str = "ripple",
+                  state_prep: str = "vector", state_prep_tolerance: float = 0.0):
+    """
+    Sets up classical parameters, performs the classical checks, and executes the QLBM kernel.
+
+    mode="sample" estimates the density from `shots` measurements of the
+    last time step, after propagate_to_last_step; mode="exact" reads the
+    probabilities from the statevector and ignores `shots`.
+    shift="ripple" streams with the mcx shift chain, shift="qft" with the
+    QFT-based adder. state_prep="vector" initializes the spatial register
+    from the amplitude vector; state_prep="gates" encodes it with the
+    memoized rotation tree from stateprep.py, dropping rotations below
+    state_prep_tolerance (sampled mode only). fused.run_fused_qlbm_d1q3
+    samples all T steps as one circuit instead, but needs 2T coin qubits,
+    so it is limited to small T; use this function for long runs.
+    """
+    
+    if mode not in ("sample", "exact"):
+        raise ValueError("mode must be either 'sample' or 'exact'.")
+    if shift not in SHIFT_METHODS:
+        raise ValueError(f"shift must be one of {SHIFT_METHODS}.")
+    if state_prep not in STATE_PREP_METHODS:
+        raise ValueError(f"state_prep must be one of {STATE_PREP_METHODS}.")
+
+    (num_spatial_qubits, is_uniform, normalization_constant,
+     theta_weight, theta_collision_vector, density_sqrt_normalized) = prepare_qlbm_parameters(density, advection_velocity)
+    qubit_count = num_spatial_qubits + 1
+
+    if mode == "exact":
+        probabilities = exact_qlbm_probabilities(
+            num_spatial_qubits,
+            timesteps,
+            theta_weight,
+            theta_collision_vector,
+            density_sqrt_normalized,
+            shift
+        )
+        return probabilities * normalization_constant**2
+
+    # 2. Fetch the compiled kernel; angles and initial state are runtime arguments
+    is_uniform, density_sqrt_normalized = propagate_to_last_step(
+        num_spatial_qubits, timesteps, is_uniform, theta_weight,
+        theta_collision_vector, density_sqrt_normalized, shift)
+    collision_controls, collision_alphas = multiplexed_ry_arguments(theta_collision_vector)
+    decomposition = None
+    if state_prep == "gates" and not is_uniform:
+        decomposition = prepare_state_decomposition(density_sqrt_normalized, state_prep_tolerance)
+    kernel = qlbm_kernel_cache.get(qubit_count, min(timesteps, 1), is_uniform, collision_controls, shift, decomposition)
+    amplitudes = density_sqrt_normalized.astype(complex).tolist()
     
     print("--- Running CUDA-Q Kernel ---")
     print(f"Target: {cudaq.get_target().name}")
-    print(f"Total Qubits: {qubit_count}, Time Steps: {timesteps}, Shots: {shots}")
+    print(f"Total Qubits: {num_spatial_qubits + 2}, Time Steps: {timesteps}, Shots: {shots}")
     
     try:
-        # 
-        counts_result = cudaq.sample(kernel, shots=shots)
-        counts = counts_result.to_dict()
-        
-        # 3. Post-processing
-        spatial_states = [format(i, f'0{num_spatial_qubits}b') for i in range(Nx)]
-        
-        final_density = np.zeros(Nx)
-        total_valid_counts = 0
+        counts_result = cudaq.sample(kernel, theta_weight, collision_alphas, amplitudes, shots_count=shots)
         
-        for state, count in counts.items():
-            spatial_part = state[1:] 
-            if spatial_part in spatial_states:
-                 idx = int(spatial_part, 2)
-                 final_density[idx] += count
-                 total_valid_counts += count
+        # 3. Post-processing (spatial register only, first spatial qubit is the LSB)
+        final_density, total_valid_counts = counts_to_density(counts_result, num_spatial_qubits, ancilla="none")
 
         probabilities = final_density / total_valid_counts
         final_density_scaled = probabilities * normalization_constant**2
@@ -203,7 +361,7 @@ def run_qlbm_d1q3(density: np.ndarray, advection_velocity: float, timesteps: int
         print(f"Error during CUDA-Q execution: {e}")
         return None
 
-# --- 5. Example Execution Block (Unchanged) ---
+# --- 4. Example Execution Block ---
 
 if __name__ == "__main__":
     print("--- Starting D1Q3 Quantum Lattice Boltzmann Example (CUDA-Q) ---")
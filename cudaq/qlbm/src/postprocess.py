@@ -0,0 +1,86 @@
+import itertools
+import numpy as np
+
+# Bulk conversion of CUDA-Q sample results into QLBM densities.
+#
+# Bitstrings are decoded as fixed-width byte arrays into uint64 site
+# indices and accumulated with np.bincount, in chunks, so the list of
+# 2**Nx spatial bitstrings is never built.
+
+ANCILLA_POSITIONS = ("first", "last", "none")
+BIT_ORDERS = ("lsb", "msb")
+
+
+def bitstrings_to_indices(bitstrings: list, num_spatial_qubits: int, ancilla: str = "first", bit_order: str = "lsb"):
+    """
+    Decodes measurement bitstrings into (site index, ancilla bit) arrays.
+
+    ancilla gives the position of the ancilla character in the bitstring
+    ("first", "last" or "none"). bit_order="lsb" reads the first spatial
+    character as bit 0, matching CUDA-Q's qubit order and the shift gates;
+    bit_order="msb" reads the spatial part as a plain binary number.
+    """
+    if ancilla not in ANCILLA_POSITIONS:
+        raise ValueError(f"ancilla must be one of {ANCILLA_POSITIONS}.")
+    if bit_order not in BIT_ORDERS:
+        raise ValueError(f"bit_order must be one of {BIT_ORDERS}.")
+    if num_spatial_qubits > 64:
+        raise ValueError("At most 64 spatial qubits fit in a uint64 index.")
+
+    width = num_spatial_qubits + (ancilla != "none")
+    # One spare byte, so a longer bitstring shows up in the length check instead of being truncated
+    raw = np.array(bitstrings, dtype=f"S{width + 1}")
+    if np.any(np.char.str_len(raw) != width):
+        raise ValueError(f"Every bitstring must have {width} characters for this register layout.")
+    bits = np.frombuffer(raw.tobytes(), dtype=np.uint8).reshape(-1, width + 1)[:, :width] - ord("0")
+
+    if ancilla == "first":
+        ancilla_bits, spatial_bits = bits[:, 0], bits[:, 1:]
+    elif ancilla == "last":
+        ancilla_bits, spatial_bits = bits[:, -1], bits[:, :-1]
+    else:
+        ancilla_bits, spatial_bits = np.zeros(len(bits), dtype=np.uint8), bits
+
+    weights = np.left_shift(np.uint64(1), np.arange(num_spatial_qubits, dtype=np.uint64))
+    if bit_order == "msb":
+        weights = weights[::-1]
+
+    indices = spatial_bits.astype(np.uint64) @ weights
+    return indices, ancilla_bits
+
+
+def counts_to_density(counts,
+                      num_spatial_qubits: int,
+                      ancilla: str = "first",
+                      bit_order: str = "lsb",
+                      ancilla_value: int = None,
+                      chunk_size: int = 1 << 16):
+    """
+    Histogram of counts per lattice site from a cudaq.SampleResult or dict.
+
+    Counts are consumed `chunk_size` entries at a time. If ancilla_value is
+    given, only outcomes with that ancilla bit are kept (post-selection);
+    otherwise the ancilla is marginalized. Returns (histogram, total_counts).
+    """
+    Nx = 2**num_spatial_qubits
+    histogram = np.zeros(Nx)
+    total_counts = 0
+
+    items = iter(counts.items())
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            break
+
+        bitstrings, chunk_counts = zip(*chunk)
+        indices, ancilla_bits = bitstrings_to_indices(bitstrings, num_spatial_qubits, ancilla, bit_order)
+        weights = np.asarray(chunk_counts, dtype=float)
+
+        if ancilla_value is not None:
+            keep = ancilla_bits == ancilla_value
+            indices, weights = indices[keep], weights[keep]
+
+        histogram += np.bincount(indices.astype(np.intp), weights=weights, minlength=Nx)
+        total_counts += int(weights.sum())
+
+    return histogram, total_counts
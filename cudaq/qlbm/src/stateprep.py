@@ -0,0 +1,152 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from ucry import apply_multiplexed_ry, gray_code_angles, reduce_ucry_controls
+
+# Gate-level amplitude encoding for real amplitude vectors.
+#
+# Mottonen-style binary tree: the rotation on the highest spatial qubit
+# splits the norm between the two halves of the lattice, and each lower
+# qubit gets a uniformly-controlled ry on all higher qubits. Every level is
+# synthesized with the Gray-code multiplexor from ucry.py, after dropping
+# controls the level's angles do not depend on, so a uniform density costs
+# one ry per qubit. The angle trees are computed with vectorized NumPy and
+# memoized by a hash of the input vector, so a sweep that reuses one
+# initial condition decomposes it once.
+#
+# Site-indexed like the rest of the QLBM code: the first qubit is the LSB.
+
+
+class StatePreparation:
+    """
+    Decomposition of one amplitude vector: per level (target, controls, alphas).
+
+    Hashable by the digest of the input vector and tolerance, so it can be
+    part of a KernelCache key.
+    """
+
+    def __init__(self, digest: str, levels: list, num_qubits: int, tolerance: float):
+        self.digest = digest
+        self.levels = levels
+        self.num_qubits = num_qubits
+        self.tolerance = tolerance
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __eq__(self, other):
+        return isinstance(other, StatePreparation) and self.digest == other.digest
+
+    def rotation_count(self):
+        return sum(int(np.sum(np.abs(alphas) > self.tolerance)) for _, _, alphas in self.levels)
+
+
+def tree_angles(amplitudes: np.ndarray):
+    """
+    Ry angles of the amplitude tree, one array per level from the highest qubit down.
+
+    Level l targets qubit n-1-l and has 2^l angles, indexed by the value of
+    the l higher qubits. Leaf angles use the signed amplitudes, so any real
+    vector is reproduced exactly.
+    """
+    amplitudes = np.asarray(amplitudes)
+    if np.iscomplexobj(amplitudes):
+        if not np.allclose(amplitudes.imag, 0):
+            raise ValueError("Only real amplitude vectors are supported.")
+        amplitudes = amplitudes.real
+    amplitudes = amplitudes.astype(float).reshape(-1)
+
+    num_qubits = int(np.log2(amplitudes.shape[0]))
+    if 2**num_qubits != amplitudes.shape[0]:
+        raise ValueError("Amplitude vector length must be a power of two.")
+
+    levels = []
+    for level in range(num_qubits):
+        target = num_qubits - 1 - level
+        blocks = amplitudes.reshape(2**level, 2, 2**target)
+        if target == 0:
+            lower, upper = blocks[:, 0, 0], blocks[:, 1, 0]
+        else:
+            lower, upper = np.linalg.norm(blocks[:, 0, :], axis=1), np.linalg.norm(blocks[:, 1, :], axis=1)
+        levels.append(2 * np.arctan2(upper, lower))
+
+    return levels
+
+
+_decompositions = OrderedDict()
+_maxsize = 64
+cache_info = {"hits": 0, "misses": 0}
+
+
+def prepare_state_decomposition(amplitudes: np.ndarray, tolerance: float = 0.0):
+    """
+    Memoized decomposition of a normalized real amplitude vector.
+
+    tolerance=0 is exact; a positive tolerance drops Gray-code rotations
+    with |alpha| <= tolerance (approximate mode for smooth densities).
+    """
+    amplitudes = np.ascontiguousarray(amplitudes)
+    digest = hashlib.sha1(amplitudes.tobytes() + repr((amplitudes.dtype.str, tolerance)).encode()).hexdigest()
+
+    if digest in _decompositions:
+        cache_info["hits"] += 1
+        _decompositions.move_to_end(digest)
+        return _decompositions[digest]
+
+    cache_info["misses"] += 1
+    num_qubits = int(np.log2(amplitudes.shape[0]))
+    prune = max(tolerance, 1e-12)
+
+    levels = []
+    for level, angles in enumerate(tree_angles(amplitudes)):
+        target = num_qubits - 1 - level
+        controls, reduced_angles = reduce_ucry_controls(angles, atol=prune)
+        # Control m of the level is qubit target + 1 + m
+        levels.append((target, tuple(target + 1 + m for m in controls), gray_code_angles(reduced_angles)))
+
+    decomposition = StatePreparation(digest, levels, num_qubits, prune)
+    _decompositions[digest] = decomposition
+    if len(_decompositions) > _maxsize:
+        _decompositions.popitem(last=False)
+    return decomposition
+
+
+def apply_state_preparation(kernel, qubits: list, decomposition: StatePreparation):
+    """Emits the decomposition on `qubits`, which must start in |0...0>."""
+    for target, controls, alphas in decomposition.levels:
+        apply_multiplexed_ry(kernel, [qubits[c] for c in controls], qubits[target], alphas, decomposition.tolerance)
+
+
+if __name__ == "__main__":
+    import time
+
+    class GateCounter:
+        def __init__(self):
+            self.ry_count = 0
+            self.cx_count = 0
+        def ry(self, theta, target):
+            self.ry_count += 1
+        def cx(self, control, target):
+            self.cx_count += 1
+
+    print(f"{'n':>3} {'tolerance':>10} {'ry':>7} {'cx':>7} {'decompose [ms]':>15} {'cached [ms]':>12}")
+    for n in (6, 10, 14):
+        Nx = 2**n
+        x = np.linspace(0, Nx - 1, Nx)
+        density = np.exp(-((x - Nx/2)**2) / (2 * (Nx/8)**2))
+        amplitudes = np.sqrt(density / np.sum(density))
+
+        for tolerance in (0.0, 1e-3, 1e-2):
+            start = time.perf_counter()
+            decomposition = prepare_state_decomposition(amplitudes, tolerance)
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            prepare_state_decomposition(amplitudes, tolerance)
+            cached = time.perf_counter() - start
+
+            counter = GateCounter()
+            apply_state_preparation(counter, list(range(n)), decomposition)
+            print(f"{n:>3} {tolerance:>10.0e} {counter.ry_count:>7} {counter.cx_count:>7} "
+                  f"{1e3 * first:>15.2f} {1e3 * cached:>12.3f}")
@@ -0,0 +1,141 @@
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cudaq
+
+from poisson1D import prepare_qlbm_parameters, propagate_to_last_step, qlbm_kernel_cache
+from postprocess import counts_to_density
+from ucry import multiplexed_ry_arguments
+from stateprep import prepare_state_decomposition
+
+# Batched parameter sweeps over (velocity, timesteps, Nx).
+#
+# On multi-QPU targets (e.g. `nvidia` with option `mqpu`) every grid point
+# is launched with cudaq.sample_async on a round-robin QPU and the futures
+# are gathered afterwards. Single-QPU CPU targets such as `qpp-cpu` run one
+# circuit at a time, so the grid is spread over a process pool instead.
+
+
+def gaussian_density(Nx: int):
+    """Normalized Gaussian pulse centred on the lattice, as in poisson1D.py."""
+    x = np.linspace(0, Nx - 1, Nx)
+    raw_density = np.exp(-((x - Nx/2)**2) / 2)
+    return raw_density / np.sum(raw_density)
+
+
+def _launch_point(density: np.ndarray, advection_velocity: float, timesteps: int, shots: int,
+                  shift: str = "ripple", state_prep: str = "vector", qpu_id: int = 0):
+    """Launches one grid point asynchronously; returns (future, num_spatial_qubits, normalization_constant)."""
+    (num_spatial_qubits, is_uniform, normalization_constant,
+     theta_weight, theta_collision_vector, density_sqrt_normalized) = prepare_qlbm_parameters(density, advection_velocity)
+
+    # All but the last time step run on the host (see propagate_to_last_step)
+    is_uniform, density_sqrt_normalized = propagate_to_last_step(
+        num_spatial_qubits, timesteps, is_uniform, theta_weight,
+        theta_collision_vector, density_sqrt_normalized, shift)
+    collision_controls, collision_alphas = multiplexed_ry_arguments(theta_collision_vector)
+    decomposition = None
+    if state_prep == "gates" and not is_uniform:
+        decomposition = prepare_state_decomposition(density_sqrt_normalized)
+    kernel = qlbm_kernel_cache.get(num_spatial_qubits + 1, min(timesteps, 1), is_uniform, collision_controls, shift, decomposition)
+    future = cudaq.sample_async(kernel,
+                                float(theta_weight),
+                                collision_alphas,
+                                density_sqrt_normalized.astype(complex).tolist(),
+                                shots_count=shots,
+                                qpu_id=qpu_id)
+    return future, num_spatial_qubits, normalization_constant
+
+
+def _collect_point(counts_result, num_spatial_qubits: int, normalization_constant: float):
+    final_density, total_valid_counts = counts_to_density(counts_result, num_spatial_qubits, ancilla="none")
+    return final_density / total_valid_counts * normalization_constant**2
+
+
+def _init_worker(target: str):
+    cudaq.set_target(target)
+
+
+def _run_point(density: np.ndarray, advection_velocity: float, timesteps: int, shots: int, shift: str, state_prep: str):
+    """Process-pool worker: runs one grid point synchronously."""
+    future, num_spatial_qubits, normalization_constant = _launch_point(density, advection_velocity, timesteps, shots,
+                                                                       shift, state_prep)
+    return _collect_point(future.get(), num_spatial_qubits, normalization_constant)
+
+
+def run_qlbm_sweep(velocities: list,
+                   timesteps_list: list,
+                   Nx_list: list,
+                   shots: int,
+                   initial_density=gaussian_density,
+                   executor: str = "auto",
+                   max_workers: int = None,
+                   shift: str = "ripple",
+                   state_prep: str = "vector"):
+    """
+    Runs the sampled QLBM over the full (velocity, timesteps, Nx) grid.
+
+    initial_density maps Nx to a density profile. executor is "async"
+    (cudaq.sample_async across QPUs), "process" (process pool, one CUDA-Q
+    runtime per worker) or "auto", which picks "async" when the current
+    target exposes more than one QPU. shift and state_prep are passed
+    through as in run_qlbm_d1q3; with state_prep="gates" each initial
+    density is decomposed once for the whole sweep.
+
+    Returns one row per grid point, in grid order, with keys
+    velocity, timesteps, Nx, shots and density.
+    """
+    if executor not in ("auto", "async", "process"):
+        raise ValueError("executor must be one of 'auto', 'async' or 'process'.")
+
+    target = cudaq.get_target()
+    if executor == "auto":
+        executor = "async" if target.num_qpus() > 1 else "process"
+
+    grid = list(itertools.product(velocities, timesteps_list, Nx_list))
+    densities = {Nx: initial_density(Nx) for Nx in Nx_list}
+
+    if executor == "async":
+        num_qpus = target.num_qpus()
+        launched = [_launch_point(densities[Nx], velocity, timesteps, shots, shift, state_prep, qpu_id=i % num_qpus)
+                    for i, (velocity, timesteps, Nx) in enumerate(grid)]
+        results = [_collect_point(future.get(), num_spatial_qubits, normalization_constant)
+                   for future, num_spatial_qubits, normalization_constant in launched]
+
+    else:
+        # Spawn rather than fork so each worker gets a clean CUDA-Q runtime
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                 mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(target.name,)) as pool:
+            futures = [pool.submit(_run_point, densities[Nx], velocity, timesteps, shots, shift, state_prep)
+                       for velocity, timesteps, Nx in grid]
+            results = [future.result() for future in futures]
+
+    return [{"velocity": velocity, "timesteps": timesteps, "Nx": Nx, "shots": shots, "density": density}
+            for (velocity, timesteps, Nx), density in zip(grid, results)]
+
+
+if __name__ == "__main__":
+    velocities = np.linspace(-0.1, 0.1, 8)
+    timesteps_list = [1, 2]
+    Nx_list = [8, 16]
+    shots = 2000
+
+    print(f"Target: {cudaq.get_target().name}, QPUs: {cudaq.get_target().num_qpus()}, CPUs: {os.cpu_count()}")
+
+    start = time.perf_counter()
+    table = run_qlbm_sweep(velocities, timesteps_list, Nx_list, shots)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'velocity':>9} {'timesteps':>9} {'Nx':>4} {'mass':>8} {'centre':>8}")
+    for row in table:
+        x = np.arange(row["Nx"])
+        centre = np.sum(x * row["density"]) / np.sum(row["density"])
+        print(f"{row['velocity']:>9.3f} {row['timesteps']:>9} {row['Nx']:>4} {np.sum(row['density']):>8.4f} {centre:>8.3f}")
+    print(f"\n{len(table)} grid points in {elapsed:.2f} s")
@@ -0,0 +1,130 @@
+import numpy as np
+
+# Multiplexed Ry (UCRY) synthesis for the builder kernels.
+#
+# apply_ucry_gate emits one X-conjugated mcry per control state, i.e. 2^n
+# multi-controlled rotations. Here the angle vector is first reduced to the
+# controls it actually depends on (a uniform vector needs none, a vector
+# that is constant on aligned blocks needs only the block bits), and the
+# remaining multiplexor uses the Gray-code decomposition of Mottonen et al.:
+# 2^k single-qubit ry rotations interleaved with 2^k CNOTs.
+#
+# Angle vectors are site-indexed: bit j of the index is control j.
+
+
+def gray_code(i: int):
+    return i ^ (i >> 1)
+
+
+def reduce_ucry_controls(angles: np.ndarray, atol: float = 1e-9):
+    """
+    Drops every control the angle vector does not depend on.
+
+    Returns (controls, reduced_angles): the indices of the remaining
+    controls and the 2^len(controls) angles indexed by those controls only.
+    """
+    angles = np.asarray(angles, dtype=float).reshape(-1)
+    num_controls = int(np.log2(angles.shape[0]))
+    indices = np.arange(angles.shape[0])
+
+    controls = tuple(j for j in range(num_controls)
+                     if not np.allclose(angles, angles[indices ^ (1 << j)], atol=atol))
+
+    # Read the angles with every dropped control fixed to |0>
+    reduced_indices = np.zeros(2**len(controls), dtype=int)
+    for m, j in enumerate(controls):
+        reduced_indices |= ((np.arange(2**len(controls)) >> m) & 1) << j
+
+    return controls, angles[reduced_indices]
+
+
+def walsh_hadamard(values: np.ndarray):
+    """Unnormalized fast Walsh-Hadamard transform: out[m] = sum_c (-1)^popcount(c & m) * values[c]."""
+    values = np.array(values, dtype=float).reshape(-1)
+    size = values.shape[0]
+    h = 1
+    while h < size:
+        blocks = values.reshape(-1, 2, h)
+        values = np.concatenate((blocks[:, 0] + blocks[:, 1], blocks[:, 0] - blocks[:, 1]), axis=1).reshape(-1)
+        h *= 2
+    return values
+
+
+def gray_code_angles(angles: np.ndarray):
+    """
+    Converts per-control-state angles into the Gray-code rotation angles.
+
+    alpha_j = 2^-k * sum_c (-1)^popcount(c & g_j) * theta_c, with g_j the
+    j-th Gray code, so that the CNOT ladder reproduces theta_c on each branch.
+    """
+    angles = np.asarray(angles, dtype=float).reshape(-1)
+    size = angles.shape[0]
+
+    return walsh_hadamard(angles)[gray_code(np.arange(size))] / size
+
+
+def multiplexed_ry_arguments(angles: np.ndarray, atol: float = 1e-9):
+    """
+    Returns (controls, alphas): the structure and runtime angles for apply_multiplexed_ry.
+    """
+    controls, reduced_angles = reduce_ucry_controls(angles, atol)
+    return controls, [float(alpha) for alpha in gray_code_angles(reduced_angles)]
+
+
+def apply_multiplexed_ry(kernel, controls: list, target, alphas, atol: float = None):
+    """
+    Applies the Gray-code multiplexed Ry with rotation angles `alphas`.
+
+    alphas may be a runtime kernel argument; if it is a NumPy array and atol
+    is given, rotations below atol are skipped and the CNOTs around them
+    merged (CNOTs onto the same target commute, so only their parity matters).
+    """
+    num_controls = len(controls)
+    size = 2**num_controls
+    pending = [False] * num_controls
+
+    for j in range(size):
+        if atol is None or abs(alphas[j]) > atol:
+            for m in range(num_controls):
+                if pending[m]:
+                    kernel.cx(controls[m], target)
+                    pending[m] = False
+            kernel.ry(alphas[j], target)
+
+        if num_controls:
+            changed_bit = (gray_code(j) ^ gray_code((j + 1) % size)).bit_length() - 1
+            pending[changed_bit] = not pending[changed_bit]
+
+    for m in range(num_controls):
+        if pending[m]:
+            kernel.cx(controls[m], target)
+
+
+def synthesize_ucry(kernel, controls: list, target, angles: np.ndarray, atol: float = 1e-9):
+    """
+    Drop-in replacement for apply_ucry_gate when the angles are known at build time.
+    """
+    reduced_controls, alphas = multiplexed_ry_arguments(angles, atol)
+    apply_multiplexed_ry(kernel, [controls[j] for j in reduced_controls], target, np.asarray(alphas), atol)
+
+
+if __name__ == "__main__":
+    print(f"{'controls':>8} {'angles':>10} {'mcry (old)':>11} {'ry':>6} {'cx':>6}")
+
+    class GateCounter:
+        def __init__(self):
+            self.ry_count = 0
+            self.cx_count = 0
+        def ry(self, theta, target):
+            self.ry_count += 1
+        def cx(self, control, target):
+            self.cx_count += 1
+
+    for n in (3, 6, 10):
+        Nx = 2**n
+        for label, angles in (("uniform", np.full(Nx, 0.7)),
+                              ("blocks", np.repeat(np.random.rand(4), Nx // 4)),
+                              ("random", np.random.rand(Nx))):
+            counter = GateCounter()
+            synthesize_ucry(counter, list(range(n)), None, angles)
+            print(f"{n:>8} {label:>10} {Nx:>11} {counter.ry_count:>6} {counter.cx_count:>6}")